@@ -38,11 +38,13 @@ from dotenv import load_dotenv
 from botocore.exceptions import ClientError
 from daily_news import process_mail
 from kaggle_exporter import KaggleAPI
+from run_ledger import create_run_ledger
 
 DOWNLOAD_EXPIRES_IN = 60 * 30  # 30 minutes
 UPLOAD_EXPIRES_IN = 60 * 120  # 120 minutes
 DAYS_RETENTION = 21
 SAMPLE_WAV_FILE_KEY = "tts_model/samples/latest/sample.wav"
+AUDIO_CACHE_PREFIX = "tts_model/audio_cache/"
 TMP_DATASET_PATH = "/tmp"
 TMP_NOTEBOOK_PATH = "/tmp/xtts-inference"
 
@@ -87,6 +89,56 @@ def generate_s3_upload_link(bucket_name: str, file_key: str):
     )
     return upload_url
 
+def generate_s3_upload_post(bucket_name: str, key_prefix: str):
+    """
+    Presigned POST which accepts any file under the key prefix, used for the audio segments
+    """
+    s3 = boto3.client("s3")
+
+    return s3.generate_presigned_post(
+        bucket_name,
+        key_prefix + "${filename}",
+        Conditions=[["starts-with", "$key", key_prefix]],
+        ExpiresIn=UPLOAD_EXPIRES_IN
+    )
+
+def generate_audio_cache_links(bucket_name: str) -> dict[str, str]:
+    """
+    Presigned download links of the audio cache index and the files it lists, keyed by
+    file name. Files the index no longer lists were evicted by the last run and are deleted.
+    """
+    s3 = boto3.client("s3")
+    try:
+        index = json.loads(s3.get_object(Bucket=bucket_name, Key=AUDIO_CACHE_PREFIX + "index.json")["Body"].read())
+    except ClientError:
+        print("No audio cache in the bucket yet")
+        return {}
+
+    listed = {entry["file"] for entry in index.values()} | {"index.json"}
+    links = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=AUDIO_CACHE_PREFIX):
+        for obj in page.get("Contents", []):
+            file_name = obj["Key"][len(AUDIO_CACHE_PREFIX):]
+            if file_name in listed:
+                links[file_name] = generate_s3_download_link(bucket_name, obj["Key"])
+            else:
+                s3.delete_object(Bucket=bucket_name, Key=obj["Key"])
+    return links
+
+def generate_checkpoint_links(bucket_name: str, key_prefix: str) -> dict[str, str]:
+    """
+    Presigned download links of the chunk checkpoints an interrupted run of the day
+    left behind, keyed by file name. They are removed with the other outputs of the day.
+    """
+    s3 = boto3.client("s3")
+    links = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=key_prefix):
+        for obj in page.get("Contents", []):
+            links[obj["Key"][len(key_prefix):]] = generate_s3_download_link(bucket_name, obj["Key"])
+    return links
+
 
 def upload_dataset_kaggle(bucket_name: str, json_file_key: str):
     print("Uploading dataset to Kaggle...")
@@ -124,7 +176,14 @@ def replace_input_url_config(bucket_name: str, json_file_key: str):
         "input_json_url": generate_s3_download_link(bucket_name, json_file_key),
         "sample_wav_url": generate_s3_download_link(bucket_name, SAMPLE_WAV_FILE_KEY),
         "output_wav_url": generate_s3_upload_link(bucket_name, json_file_key.replace(fname, "news.wav")),
+        "output_ogg_url": generate_s3_upload_link(bucket_name, json_file_key.replace(fname, "news.ogg")),
+        "output_segments_post": generate_s3_upload_post(bucket_name, json_file_key.replace(fname, "segments/")),
         "output_metadata_url": generate_s3_upload_link(bucket_name, json_file_key.replace(fname, "output_metadata.json")),
+        # The run has no AWS credentials, the cache is synced through presigned links too
+        "audio_cache_urls": generate_audio_cache_links(bucket_name),
+        "audio_cache_post": generate_s3_upload_post(bucket_name, AUDIO_CACHE_PREFIX),
+        "checkpoint_urls": generate_checkpoint_links(bucket_name, json_file_key.replace(fname, "checkpoints/")),
+        "checkpoint_post": generate_s3_upload_post(bucket_name, json_file_key.replace(fname, "checkpoints/")),
     }
     
     for root, _, files in os.walk(TMP_DATASET_PATH):
@@ -185,36 +244,57 @@ def lambda_handler(event, context):
 
     date_today  = datetime.today()
     key_in_bucket = f"outputs/{date_today.year}/{date_today.month}/{date_today.day}/parsed_news.json"
+    ledger_key = key_in_bucket.replace("parsed_news.json", "run_ledger.json")
     
     run_mode = os.environ.get("RUN_MODE", "TEST")
     print(f"Runing mode: {run_mode}")
 
-    if s3_file_exists(bucket_name, key_in_bucket):
-        print(f"File already exists in S3 bucket: {bucket_name}/{key_in_bucket}, skipping processing")
-        return {
-            'statusCode': 200,
-            'body': json.dumps('File already exists, skipping processing')
-        }
+    ledger = create_run_ledger(run_mode, bucket_name, ledger_key)
 
-    parsed_content = process_mail(run_mode, get_secret("mail-key"), get_secret("pinecone-key"), get_secret("google-api"))
-
-    if parsed_content is None:
-        print("Email not found or no content to process, skipping upload")
+    if not ledger.claim():
+        print(f"Run is already claimed or finished: {bucket_name}/{ledger_key}, skipping processing")
         return {
             'statusCode': 200,
-            'body': json.dumps('No content to upload')
+            'body': json.dumps('Run already claimed or finished, skipping processing')
         }
 
-    upload_success =  upload_to_bucket(bucket_name, key_in_bucket, parsed_content)
-
-    if upload_success:
-        upload_dataset_kaggle(bucket_name, key_in_bucket)
-        time.sleep(60)  # Wait for Kaggle to process the new dataset
-        start_kaggle_notebook()
+    try:
+        if not ledger.is_done("parsed_news"):
+            # The file may exist without the stage if the previous run stopped right after uploading
+            if not s3_file_exists(bucket_name, key_in_bucket):
+                parsed_content = process_mail(run_mode, get_secret("mail-key"), get_secret("pinecone-key"), get_secret("google-api"))
+
+                if parsed_content is None:
+                    print("Email not found or no content to process, skipping upload")
+                    ledger.release()
+                    return {
+                        'statusCode': 200,
+                        'body': json.dumps('No content to upload')
+                    }
+
+                if not upload_to_bucket(bucket_name, key_in_bucket, parsed_content):
+                    ledger.release()
+                    return {
+                        'statusCode': 500,
+                        'body': json.dumps('Processing mails finished: False')
+                    }
+            ledger.complete("parsed_news")
+
+        if not ledger.is_done("kaggle_dataset"):
+            upload_dataset_kaggle(bucket_name, key_in_bucket)
+            ledger.complete("kaggle_dataset")
+            time.sleep(60)  # Wait for Kaggle to process the new dataset
+
+        if not ledger.is_done("kaggle_notebook"):
+            start_kaggle_notebook()
+            ledger.complete("kaggle_notebook")
+    except Exception:
+        ledger.release()
+        raise
 
     clean_up_directories(bucket_name)
 
     return {
-        'statusCode': 200 if upload_success else 500,
-        'body': json.dumps(f'Processing mails finished: {upload_success}')
-    }
\ No newline at end of file
+        'statusCode': 200,
+        'body': json.dumps('Processing mails finished: True')
+    }
@@ -0,0 +1,162 @@
+import json
+import os
+import time
+import boto3
+
+from botocore.exceptions import ClientError
+
+# Stages of the daily pipeline, in the order lambda_handler runs them
+STAGES = ["parsed_news", "kaggle_dataset", "kaggle_notebook"]
+# A claim older than this is considered abandoned, Lambda runs at most 15 minutes
+LEASE_SECONDS = 60 * 20
+_CONDITION_FAILED_CODES = ["PreconditionFailed", "ConditionalRequestConflict", "412"]
+
+
+def _new_state():
+    return {"claimed_at": int(time.time()), "completed_stages": []}
+
+
+def _can_take_over(state: dict) -> bool:
+    """
+    A day can be taken over when it still has unfinished stages and
+    nobody holds a fresh claim on it
+    """
+    if all(stage in state["completed_stages"] for stage in STAGES):
+        return False
+    return int(time.time()) - state["claimed_at"] > LEASE_SECONDS
+
+
+class RunLedger:
+    """
+    Keeps the run state of a single day as a JSON object in the S3 bucket.
+    The day is claimed with a conditional put (If-None-Match) so overlapping
+    triggers cannot both run the pipeline, and every update is conditioned
+    on the ETag of the last seen version.
+    """
+
+    def __init__(self, bucket_name: str, ledger_key: str):
+        self.s3_client = boto3.client('s3')
+        self.bucket_name = bucket_name
+        self.ledger_key = ledger_key
+        self._state = None
+        self._etag = None
+
+    def claim(self) -> bool:
+        """
+        Tries to claim the day for this run. Returns False if another run
+        holds the claim or every stage is already completed
+        """
+        state = _new_state()
+        try:
+            response = self.s3_client.put_object(
+                Body=json.dumps(state).encode('utf-8'),
+                Bucket=self.bucket_name,
+                Key=self.ledger_key,
+                IfNoneMatch="*"
+            )
+            self._state, self._etag = state, response["ETag"]
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] not in _CONDITION_FAILED_CODES:
+                raise
+
+        existing_state, etag = self._read()
+        if not _can_take_over(existing_state):
+            return False
+
+        existing_state["claimed_at"] = state["claimed_at"]
+        return self._write(existing_state, etag)
+
+    def is_done(self, stage: str) -> bool:
+        return stage in self._state["completed_stages"]
+
+    def complete(self, stage: str):
+        """
+        Marks the stage as completed, raises if the claim was lost meanwhile
+        """
+        self._state["completed_stages"].append(stage)
+        if not self._write(self._state, self._etag):
+            raise RuntimeError(f"Lost the claim on {self.ledger_key} while completing {stage}")
+
+    def release(self):
+        """
+        Drops the claim so a retry can resume right away instead of waiting the lease
+        """
+        self._state["claimed_at"] = 0
+        self._write(self._state, self._etag)
+
+    def _read(self):
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.ledger_key)
+        return json.loads(response["Body"].read()), response["ETag"]
+
+    def _write(self, state: dict, etag: str) -> bool:
+        try:
+            response = self.s3_client.put_object(
+                Body=json.dumps(state).encode('utf-8'),
+                Bucket=self.bucket_name,
+                Key=self.ledger_key,
+                IfMatch=etag
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in _CONDITION_FAILED_CODES:
+                return False
+            raise
+        self._state, self._etag = state, response["ETag"]
+        return True
+
+
+class LocalRunLedger:
+    """
+    Local stand-in of RunLedger which keeps the state in a file,
+    the day is claimed by creating the file exclusively
+    """
+
+    def __init__(self, ledger_path: str):
+        self.ledger_path = ledger_path
+        self._state = None
+
+    def claim(self) -> bool:
+        os.makedirs(os.path.dirname(self.ledger_path) or ".", exist_ok=True)
+        state = _new_state()
+        try:
+            fd = os.open(self.ledger_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            with open(self.ledger_path, "r", encoding="utf-8") as jf:
+                existing_state = json.load(jf)
+            if not _can_take_over(existing_state):
+                return False
+            existing_state["claimed_at"] = state["claimed_at"]
+            self._write(existing_state)
+            return True
+
+        with os.fdopen(fd, "w", encoding="utf-8") as jf:
+            json.dump(state, jf)
+        self._state = state
+        return True
+
+    def is_done(self, stage: str) -> bool:
+        return stage in self._state["completed_stages"]
+
+    def complete(self, stage: str):
+        self._state["completed_stages"].append(stage)
+        self._write(self._state)
+
+    def release(self):
+        self._state["claimed_at"] = 0
+        self._write(self._state)
+
+    def _write(self, state: dict):
+        tmp_path = self.ledger_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as jf:
+            json.dump(state, jf)
+        os.replace(tmp_path, self.ledger_path)
+        self._state = state
+
+
+def create_run_ledger(run_mode: str, bucket_name: str, ledger_key: str):
+    """
+    Returns the ledger for the run mode, LOCAL_TEST runs keep it on the disk
+    """
+    if run_mode == "LOCAL_TEST":
+        return LocalRunLedger(ledger_key)
+    return RunLedger(bucket_name, ledger_key)
@@ -0,0 +1,105 @@
+import json
+import os
+import sys
+import time
+import pytest
+import run_ledger
+
+from run_ledger import LEASE_SECONDS
+from run_ledger import LocalRunLedger
+from run_ledger import STAGES
+from unittest import mock
+
+
+@pytest.fixture
+def ledger_path(tmp_path):
+    return str(tmp_path / "outputs" / "run_ledger.json")
+
+
+def test_second_claim_fails_while_the_first_is_fresh(ledger_path):
+    assert LocalRunLedger(ledger_path).claim()
+    assert not LocalRunLedger(ledger_path).claim()
+
+
+def test_released_claim_is_taken_over_with_completed_stages(ledger_path):
+    first = LocalRunLedger(ledger_path)
+    assert first.claim()
+    first.complete(STAGES[0])
+    first.release()
+
+    second = LocalRunLedger(ledger_path)
+    assert second.claim()
+    assert second.is_done(STAGES[0])
+    assert not second.is_done(STAGES[1])
+
+
+def test_expired_claim_is_taken_over(ledger_path, monkeypatch):
+    assert LocalRunLedger(ledger_path).claim()
+
+    now = time.time()
+    monkeypatch.setattr(run_ledger.time, "time", lambda: now + LEASE_SECONDS + 1)
+    assert LocalRunLedger(ledger_path).claim()
+
+
+def test_finished_day_is_never_claimed(ledger_path, monkeypatch):
+    ledger = LocalRunLedger(ledger_path)
+    assert ledger.claim()
+    for stage in STAGES:
+        ledger.complete(stage)
+    ledger.release()
+
+    assert not LocalRunLedger(ledger_path).claim()
+    now = time.time()
+    monkeypatch.setattr(run_ledger.time, "time", lambda: now + LEASE_SECONDS + 1)
+    assert not LocalRunLedger(ledger_path).claim()
+
+
+@pytest.fixture
+def lambda_function(tmp_path, monkeypatch):
+    """
+    Imports the handler with the SSM secrets stubbed and the external stages recorded,
+    the ledger is kept on the disk in the LOCAL_TEST mode
+    """
+    ssm = mock.MagicMock()
+    ssm.get_parameter.return_value = {"Parameter": {"Value": "secret"}}
+    with mock.patch("boto3.client", return_value=ssm):
+        sys.modules.pop("lambda_function", None)
+        import lambda_function
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("RUN_MODE", "LOCAL_TEST")
+    monkeypatch.setenv("BUCKET_NAME", "bucket")
+    calls = []
+    monkeypatch.setattr(lambda_function, "get_secret", lambda key: "secret")
+    monkeypatch.setattr(lambda_function, "s3_file_exists", lambda bucket, key: False)
+    monkeypatch.setattr(lambda_function, "process_mail", lambda *args: calls.append("parsed_news") or [{"section_title": "Gündem", "text": []}])
+    monkeypatch.setattr(lambda_function, "upload_to_bucket", lambda *args: True)
+    monkeypatch.setattr(lambda_function, "upload_dataset_kaggle", lambda *args: calls.append("kaggle_dataset"))
+    monkeypatch.setattr(lambda_function, "start_kaggle_notebook", lambda: calls.append("kaggle_notebook"))
+    monkeypatch.setattr(lambda_function, "clean_up_directories", lambda bucket: None)
+    monkeypatch.setattr(lambda_function.time, "sleep", lambda seconds: None)
+    return lambda_function, calls
+
+
+def _ledger_path() -> str:
+    today = time.localtime()
+    return os.path.join("outputs", str(today.tm_year), str(today.tm_mon), str(today.tm_mday), "run_ledger.json")
+
+
+def test_handler_skips_completed_stages(lambda_function):
+    handler, calls = lambda_function
+    os.makedirs(os.path.dirname(_ledger_path()))
+    with open(_ledger_path(), "w", encoding="utf-8") as jf:
+        json.dump({"claimed_at": 0, "completed_stages": ["parsed_news", "kaggle_dataset"]}, jf)
+
+    assert handler.lambda_handler({}, None)["statusCode"] == 200
+    assert calls == ["kaggle_notebook"]
+    with open(_ledger_path(), "r", encoding="utf-8") as jf:
+        assert json.load(jf)["completed_stages"] == STAGES
+
+
+def test_handler_does_not_run_a_finished_day_again(lambda_function):
+    handler, calls = lambda_function
+    handler.lambda_handler({}, None)
+    handler.lambda_handler({}, None)
+    assert calls == STAGES
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+AUDIO_CACHE_DIR = "audio_cache"
+# Upper limit of the stored audio, the least recently used entries are evicted beyond it
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+_INDEX_FILE = "index.json"
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class AudioCache:
+    """
+    Content addressed store of synthesized chunks which persists across days.
+    Entries are keyed by the normalized text, the speaker sample, the model version
+    and the language, and kept as int16 .npy files listed in an index file.
+    The directory can be synced to S3 or a Kaggle dataset between runs.
+    """
+    def __init__(self, speaker_hash: str, model_version: str, language: str,
+                 cache_dir: str = AUDIO_CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES):
+        self._key_prefix = f"{speaker_hash}:{model_version}:{language}"
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, _INDEX_FILE)
+        self._index = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r", encoding="utf-8") as jf:
+                self._index = json.load(jf)
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self._key_prefix}:{_normalize_text(text)}".encode()).hexdigest()
+
+    def get(self, text: str) -> np.ndarray | None:
+        """
+        Returns the cached float32 audio of the text, None if it was never synthesized
+        """
+        key = self._key(text)
+        entry = self._index.get(key)
+        if entry is None or not os.path.exists(os.path.join(self._cache_dir, entry["file"])):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        entry["last_used"] = time.time()
+        self._save_index()
+        samples = np.load(os.path.join(self._cache_dir, entry["file"]))
+        return samples.astype(np.float32) / 32767.0
+
+    def put(self, text: str, samples: np.ndarray):
+        """
+        Stores the float audio of the text as int16 and evicts old entries above the size limit
+        """
+        key = self._key(text)
+        file_name = f"{key}.npy"
+        int16 = (np.clip(samples, -1.0, 1.0) * 32767.0).astype(np.int16)
+
+        tmp_path = os.path.join(self._cache_dir, f"{key}.tmp.npy")
+        np.save(tmp_path, int16)
+        os.replace(tmp_path, os.path.join(self._cache_dir, file_name))
+
+        self._index[key] = {"file": file_name, "size": int16.nbytes, "last_used": time.time()}
+        self._evict()
+        self._save_index()
+
+    def _evict(self):
+        total_size = sum(entry["size"] for entry in self._index.values())
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]["last_used"]):
+            if total_size <= self._max_bytes:
+                break
+            total_size -= entry["size"]
+            del self._index[key]
+            file_path = os.path.join(self._cache_dir, entry["file"])
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def _save_index(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as jf:
+            json.dump(self._index, jf)
+        os.replace(tmp_path, self._index_path)
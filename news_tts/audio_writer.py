@@ -0,0 +1,340 @@
+import json
+import os
+import shutil
+import wave
+import numpy as np
+import soundfile as sf
+
+from abc import ABC
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from scipy.signal import resample_poly
+
+# Opus only supports 8, 12, 16, 24 and 48 kHz, the audio is resampled to it
+OPUS_SAMPLE_RATE = 24000
+# Frames are handed to the encoder in parts of at least this length
+MIN_ENCODE_SECONDS = 10
+
+
+class _MetadataWriter(ABC):
+    """
+    Rewrites the metadata file with each entry so it is always complete up to the last chunk
+    """
+    def __init__(self, metadata_path: str):
+        self._metadata_path = metadata_path
+        self._metadata = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, samples: np.ndarray, metadata_entry: dict):
+        """
+        Appends float samples in [-1, 1] together with their metadata.
+        The samples array may be modified in place.
+        """
+        self.write_frames(samples)
+        self.write_metadata(metadata_entry)
+
+    @abstractmethod
+    def write_frames(self, samples: np.ndarray):
+        pass
+
+    def write_metadata(self, metadata_entry: dict):
+        self._metadata.append(metadata_entry)
+        self._write_metadata()
+
+    def close(self):
+        self._write_metadata()
+
+    def _write_metadata(self):
+        tmp_path = self._metadata_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as mf:
+            json.dump(self._metadata, mf, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self._metadata_path)
+
+
+class StreamingWavWriter(_MetadataWriter):
+    """
+    Writes the generated audio chunk by chunk into a 16-bit mono WAV file.
+    The header is patched after every chunk and the metadata file is rewritten
+    with each entry, so an interrupted run still leaves usable files behind.
+    """
+    def __init__(self, wav_path: str, metadata_path: str, sample_rate: int):
+        super().__init__(metadata_path)
+
+        self._file = open(wav_path, "wb")
+        self._wav = wave.open(self._file, "wb")
+        self._wav.setnchannels(1)
+        self._wav.setsampwidth(2)  # bytes for int16
+        self._wav.setframerate(sample_rate)
+
+    def write_frames(self, samples: np.ndarray):
+        """
+        Appends float samples in [-1, 1] as int16 PCM frames, readers of the file
+        see them right away. The samples array is modified in place.
+        """
+        np.clip(samples, -1.0, 1.0, out=samples)
+        samples *= 32767.0
+        self._wav.writeframes(samples.astype(np.int16).tobytes())
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._wav.close()
+        self._file.close()
+        super().close()
+
+
+def _resample_for_opus(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    samples = np.clip(samples, -1.0, 1.0)
+    if sample_rate == OPUS_SAMPLE_RATE:
+        return samples
+    gcd = np.gcd(sample_rate, OPUS_SAMPLE_RATE)
+    return resample_poly(samples, OPUS_SAMPLE_RATE // gcd, sample_rate // gcd).astype(np.float32)
+
+
+def _resample_part(context: np.ndarray, sample_rate: int, skip: int, length: int | None) -> np.ndarray:
+    resampled = _resample_for_opus(context, sample_rate)
+    return resampled[skip:] if length is None else resampled[skip:skip + length]
+
+
+class StreamingOggOpusWriter(_MetadataWriter):
+    """
+    Writes the generated audio into an Ogg Opus file through libsndfile.
+    Parts of the audio are resampled in a thread pool and encoded in order on a
+    background thread while the generation continues. The audio stays a single
+    stream of the same length, so the metadata timestamps stay accurate.
+    Each part is resampled with the samples around it and trimmed back, so the
+    parts join as if the whole audio was resampled at once, without clicks.
+    """
+    def __init__(self, ogg_path: str, metadata_path: str, sample_rate: int, max_workers: int = 4):
+        super().__init__(metadata_path)
+        self._sample_rate = sample_rate
+        self._sound_file = sf.SoundFile(ogg_path, "w", samplerate=OPUS_SAMPLE_RATE, channels=1, format="OGG", subtype="OPUS")
+        self._resample_executor = ThreadPoolExecutor(max_workers=max_workers)
+        # A single thread keeps the parts in order while encoding
+        self._encode_executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_encodes = []
+        self._buffer = []
+        self._buffer_length = 0
+
+        gcd = np.gcd(sample_rate, OPUS_SAMPLE_RATE)
+        self._up = OPUS_SAMPLE_RATE // gcd
+        self._down = sample_rate // gcd
+        # Input samples the resampling filter reaches on each side, rounded up to whole
+        # steps of the ratio so every part starts at an exact output sample
+        filter_reach = int(np.ceil(10 * max(self._up, self._down) / self._up))
+        self._margin = 0 if self._up == self._down else self._down * (filter_reach // self._down + 1)
+        # Last input samples of the previous part, the context of the next one
+        self._history = np.zeros(0, dtype=np.float32)
+
+    def write_frames(self, samples: np.ndarray):
+        self._buffer.append(samples)
+        self._buffer_length += len(samples)
+        if self._buffer_length >= MIN_ENCODE_SECONDS * self._sample_rate:
+            self._submit_buffer()
+
+    def close(self):
+        if self._sound_file.closed:
+            return
+        self._submit_buffer(final=True)
+        for pending_encode in self._pending_encodes:
+            pending_encode.result()
+        self._resample_executor.shutdown()
+        self._encode_executor.shutdown()
+        self._sound_file.close()
+        super().close()
+
+    def _submit_buffer(self, final: bool = False):
+        samples = np.concatenate(self._buffer) if self._buffer_length > 0 else np.zeros(0, dtype=np.float32)
+        # The end of the buffer waits for the next part, it is the lookahead of this one
+        emitted = len(samples) if final else (len(samples) - self._margin) // self._down * self._down
+        if emitted <= 0:
+            return
+
+        context = np.concatenate([self._history, samples if final else samples[:emitted + self._margin]])
+        skip = len(self._history) * self._up // self._down
+        length = None if final else emitted * self._up // self._down
+        resampled = self._resample_executor.submit(_resample_part, context, self._sample_rate, skip, length)
+        self._pending_encodes.append(self._encode_executor.submit(self._encode, resampled))
+        # Finished encodes are dropped so errors surface early and memory stays flat
+        while len(self._pending_encodes) > 0 and self._pending_encodes[0].done():
+            self._pending_encodes.pop(0).result()
+
+        self._history = np.concatenate([self._history, samples[:emitted]])[max(0, len(self._history) + emitted - self._margin):]
+        rest = samples[emitted:]
+        self._buffer = [rest] if len(rest) > 0 else []
+        self._buffer_length = len(rest)
+
+    def _encode(self, resampled):
+        self._sound_file.write(resampled.result())
+
+
+class SegmentedOggOpusWriter(_MetadataWriter):
+    """
+    Writes the generated audio as a sequence of Ogg Opus segments with an HLS style
+    playlist and a chapter index. A segment is cut before every section title, or at
+    the first chunk end after the segment duration if one is given. Finished segments
+    are encoded on a background thread and handed to on_segment, e.g. to upload them,
+    together with the updated playlist so clients can start playing the first ones.
+    """
+    def __init__(self, segments_dir: str, metadata_path: str, sample_rate: int, section_titles: list[str],
+                 segment_seconds: float | None = None, on_segment=None):
+        super().__init__(metadata_path)
+        os.makedirs(segments_dir, exist_ok=True)
+        self._segments_dir = segments_dir
+        self._sample_rate = sample_rate
+        self._section_titles = section_titles
+        self._segment_seconds = segment_seconds
+        self._on_segment = on_segment
+
+        self._encode_executor = ThreadPoolExecutor(max_workers=1)
+        # A single thread uploads each segment before the playlist which lists it
+        self._upload_executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+        self._uploads = []
+        self._segments = []
+        self._encoded_segments = 0
+        self._chapters = []
+        self._next_section = 0
+        self._current_section = None
+        self._segment_title = None
+
+        # Frames of the current segment, cut only at chunk ends
+        self._buffer = []
+        self._buffer_length = 0
+        self._chunk_end = 0
+        self._total_samples = 0
+        self._closed = False
+
+    @property
+    def playlist_path(self) -> str:
+        return os.path.join(self._segments_dir, "playlist.m3u8")
+
+    @property
+    def _snapshots_dir(self) -> str:
+        return os.path.join(self._segments_dir, "playlist_snapshots")
+
+    @property
+    def chapters_path(self) -> str:
+        return os.path.join(self._segments_dir, "chapters.json")
+
+    def write_frames(self, samples: np.ndarray):
+        self._buffer.append(samples)
+        self._buffer_length += len(samples)
+        self._total_samples += len(samples)
+
+    def write_metadata(self, metadata_entry: dict):
+        if self._next_section < len(self._section_titles) and metadata_entry["text"] == self._section_titles[self._next_section]:
+            # Frames of the title are already buffered, the previous section ends before them
+            if self._segment_seconds is None:
+                self._cut(self._chunk_end)
+            self._next_section += 1
+            self._current_section = metadata_entry["text"]
+            if self._segment_title is None:
+                self._segment_title = self._current_section
+            self._chapters.append({
+                "title": metadata_entry["text"],
+                "start_ms": metadata_entry["start_ms"],
+                "segment": len(self._segments),
+                "segment_offset_ms": int(self._chunk_end / self._sample_rate * 1000)
+            })
+
+        self._chunk_end = self._buffer_length
+        metadata_entry["segment"] = len(self._segments)
+        super().write_metadata(metadata_entry)
+
+        if self._segment_seconds is not None and self._buffer_length >= self._segment_seconds * self._sample_rate:
+            self._cut(self._buffer_length)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._cut(self._buffer_length)
+        for pending in self._pending:
+            pending.result()
+        self._encode_executor.shutdown()
+
+        total_ms = int(self._total_samples / self._sample_rate * 1000)
+        for chapter, next_chapter in zip(self._chapters, self._chapters[1:] + [None]):
+            chapter["end_ms"] = total_ms if next_chapter is None else next_chapter["start_ms"]
+        with open(self.chapters_path, "w", encoding="utf-8") as f:
+            json.dump(self._chapters, f, ensure_ascii=False, indent=4)
+        self._write_playlist(finished=True)
+
+        if self._on_segment is not None:
+            self._upload(self.chapters_path)
+            self._upload(self.playlist_path)
+        self._upload_executor.shutdown()
+        # Raises the first failed upload, the output is incomplete without it
+        for upload in self._uploads:
+            upload.result()
+        shutil.rmtree(self._snapshots_dir, ignore_errors=True)
+        super().close()
+
+    def _cut(self, length: int):
+        if length == 0:
+            return
+        samples = np.concatenate(self._buffer)
+        rest = samples[length:]
+        self._buffer = [rest] if len(rest) > 0 else []
+        self._buffer_length = len(rest)
+        self._chunk_end -= length
+
+        file_name = f"segment_{len(self._segments):05d}.ogg"
+        self._segments.append({
+            "file": file_name,
+            "duration": length / self._sample_rate,
+            "title": self._segment_title or self._current_section
+        })
+        self._segment_title = None
+        self._pending.append(self._encode_executor.submit(self._encode, samples[:length], file_name))
+        # Finished encodes are dropped so errors surface early
+        while len(self._pending) > 0 and self._pending[0].done():
+            self._pending.pop(0).result()
+
+    def _encode(self, samples: np.ndarray, file_name: str):
+        segment_path = os.path.join(self._segments_dir, file_name)
+        sf.write(segment_path, _resample_for_opus(samples, self._sample_rate), OPUS_SAMPLE_RATE, format="OGG", subtype="OPUS")
+        self._encoded_segments += 1
+        self._write_playlist(finished=False)
+
+        if self._on_segment is not None:
+            # Later encodes rewrite the playlist, the upload gets the one listing this segment
+            snapshot_dir = os.path.join(self._snapshots_dir, f"{self._encoded_segments:05d}")
+            os.makedirs(snapshot_dir, exist_ok=True)
+            snapshot_path = os.path.join(snapshot_dir, os.path.basename(self.playlist_path))
+            shutil.copyfile(self.playlist_path, snapshot_path)
+            self._upload(segment_path)
+            self._upload(snapshot_path)
+
+    def _upload(self, path: str):
+        self._uploads.append(self._upload_executor.submit(self._on_segment, path))
+        # Finished uploads are dropped so errors surface early
+        while len(self._uploads) > 0 and self._uploads[0].done():
+            self._uploads.pop(0).result()
+
+    def _write_playlist(self, finished: bool):
+        segments = self._segments[:self._encoded_segments]
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{max([int(np.ceil(s['duration'])) for s in segments], default=0)}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+        ]
+        for segment in segments:
+            lines.append(f"#EXTINF:{segment['duration']:.3f},{segment['title'] or ''}")
+            lines.append(segment["file"])
+        if finished:
+            lines.append("#EXT-X-ENDLIST")
+
+        tmp_path = self.playlist_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.playlist_path)
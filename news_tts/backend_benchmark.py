@@ -0,0 +1,62 @@
+import argparse
+import time
+import numpy as np
+import torch
+
+from backends import BACKENDS
+from cpu_benchmark import load_text_chunks
+from generator import Generator
+
+
+def _speaker_similarity(xtts_model, audio_a: np.ndarray, audio_b: np.ndarray) -> float:
+    """
+    Cosine similarity of the speaker embeddings of two outputs. Sampling makes the
+    waveforms differ between runs, the voice itself should stay the same.
+    """
+    sample_rate = xtts_model.args.output_sample_rate
+    embedding_a = xtts_model.get_speaker_embedding(torch.from_numpy(audio_a)[None], sample_rate).flatten()
+    embedding_b = xtts_model.get_speaker_embedding(torch.from_numpy(audio_b)[None], sample_rate).flatten()
+    return float(torch.nn.functional.cosine_similarity(embedding_a, embedding_b, dim=0))
+
+
+def _run_backend(model_path: str, sample_wav: str, text_chunks: list[str], backend: str):
+    gen = Generator(tts_model_path=model_path, speaker_audio_sample_path=sample_wav, backend=backend)
+    outputs = []
+
+    start_time = time.perf_counter()
+    for i, text_chunk in enumerate(text_chunks):
+        # Same seed for every backend so the sampled tokens are as close as possible
+        torch.manual_seed(i)
+        outputs.append(gen.synthesize(text_chunk))
+    elapsed = time.perf_counter() - start_time
+
+    audio_seconds = sum(len(output) for output in outputs) / gen.get_sample_rate()
+    return gen, outputs, elapsed / audio_seconds
+
+
+def main():
+    p = argparse.ArgumentParser(description="Compares the real-time factor and the output of the inference backends.")
+    p.add_argument("--model-path", help="Path of the XTTS model.")
+    p.add_argument("--sample-wav", default="sample.wav", help="Reference speaker audio.")
+    p.add_argument("--json-file", default="input.json", help="Parsed news file to take the chunks from.")
+    p.add_argument("--num-chunks", type=int, default=8, help="Number of chunks synthesized with each backend.")
+    args = p.parse_args()
+
+    text_chunks = load_text_chunks(args.json_file, f"{args.model_path}/vocab.json", args.num_chunks)
+    reference_gen, reference_outputs, reference_rtf = _run_backend(args.model_path, args.sample_wav, text_chunks, "torch")
+    reference_model = reference_gen.get_xtts_model()
+
+    print(f"{'backend':>8} {'rtf':>6} {'speaker_sim':>12} {'duration_ratio':>15}")
+    print(f"{'torch':>8} {reference_rtf:>6.2f} {1.0:>12.3f} {1.0:>15.3f}")
+
+    for backend in BACKENDS:
+        if backend == "torch":
+            continue
+        _, outputs, rtf = _run_backend(args.model_path, args.sample_wav, text_chunks, backend)
+        similarity = np.mean([_speaker_similarity(reference_model, a, b) for a, b in zip(reference_outputs, outputs)])
+        duration_ratio = sum(len(output) for output in outputs) / sum(len(output) for output in reference_outputs)
+        print(f"{backend:>8} {rtf:>6.2f} {similarity:>12.3f} {duration_ratio:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
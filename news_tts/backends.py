@@ -0,0 +1,41 @@
+import torch
+
+from transformers.pytorch_utils import Conv1D
+
+BACKENDS = ["torch", "int8"]
+
+
+def _conv1d_to_linear(module: torch.nn.Module):
+    """
+    GPT-2 blocks use Conv1D layers which dynamic quantization does not know about.
+    They are replaced with the equivalent nn.Linear layers, Conv1D keeps the weight transposed.
+    """
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+
+def apply_backend(xtts_model, backend: str, device: str):
+    """
+    Prepares the XTTS model for the given backend. The int8 backend quantizes the
+    linear layers of the GPT and the decoder dynamically, it only runs on CPU.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}, expected one of {BACKENDS}")
+
+    if backend == "torch":
+        return xtts_model
+
+    if device != "cpu":
+        raise ValueError("The int8 backend only runs on CPU")
+
+    _conv1d_to_linear(xtts_model.gpt)
+    xtts_model.gpt = torch.ao.quantization.quantize_dynamic(xtts_model.gpt, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    xtts_model.hifigan_decoder = torch.ao.quantization.quantize_dynamic(xtts_model.hifigan_decoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return xtts_model
@@ -0,0 +1,71 @@
+import numpy as np
+import torch
+
+
+def bucket_by_length(token_lengths: list[int], batch_size: int) -> list[list[int]]:
+    """
+    Groups the indices of the texts into batches of similar token lengths
+    so the padding inside a batch stays small
+    """
+    sorted_indices = sorted(range(len(token_lengths)), key=lambda i: token_lengths[i])
+    return [sorted_indices[i:i + batch_size] for i in range(0, len(sorted_indices), batch_size)]
+
+
+@torch.no_grad()
+def batched_inference(xtts_model, texts: list[str], language: str, gpt_cond_latent, speaker_embedding) -> list[np.ndarray]:
+    """
+    Runs the autoregressive GPT and the HiFi-GAN decoder of XTTS on a batch of texts.
+    Follows Xtts.inference, but with padded text tokens and a batched conditioning latent.
+    Returns the audio of each text in the given order.
+    """
+    config = xtts_model.config
+    gpt = xtts_model.gpt
+    device = gpt_cond_latent.device
+    batch_size = len(texts)
+
+    token_lists = [xtts_model.tokenizer.encode(text.strip().lower(), lang=language) for text in texts]
+    text_lengths = torch.tensor([len(tokens) for tokens in token_lists], device=device)
+    text_tokens = torch.full((batch_size, int(text_lengths.max())), gpt.stop_text_token, dtype=torch.int32, device=device)
+    for i, tokens in enumerate(token_lists):
+        text_tokens[i, :len(tokens)] = torch.tensor(tokens, dtype=torch.int32, device=device)
+
+    cond_latents = gpt_cond_latent.expand(batch_size, -1, -1)
+    gpt_codes = gpt.generate(
+        cond_latents=cond_latents,
+        text_inputs=text_tokens,
+        input_tokens=None,
+        do_sample=True,
+        top_p=config.top_p,
+        top_k=config.top_k,
+        temperature=config.temperature,
+        num_return_sequences=1,
+        num_beams=1,
+        length_penalty=config.length_penalty,
+        repetition_penalty=config.repetition_penalty,
+        output_attentions=False,
+    )
+
+    # Sequences which finish early are filled with the stop token until the longest one ends
+    code_lengths = []
+    for codes in gpt_codes:
+        stop_positions = (codes == gpt.stop_audio_token).nonzero()
+        code_lengths.append(int(stop_positions[0]) if len(stop_positions) > 0 else codes.shape[-1])
+    code_lengths = torch.tensor(code_lengths, device=device)
+
+    gpt_latents = gpt(
+        text_tokens,
+        text_lengths,
+        gpt_codes,
+        code_lengths * gpt.code_stride_len,
+        cond_latents=cond_latents,
+        return_attentions=False,
+        return_latent=True,
+    )
+
+    # Padded latent frames are zeroed so they do not leak into the decoded audio of shorter items
+    frame_mask = torch.arange(gpt_latents.shape[1], device=device)[None, :] < code_lengths[:, None]
+    gpt_latents = gpt_latents * frame_mask.unsqueeze(-1)
+    wavs = xtts_model.hifigan_decoder(gpt_latents, g=speaker_embedding.expand(batch_size, -1, -1)).squeeze(1).cpu()
+
+    samples_per_frame = wavs.shape[-1] / gpt_latents.shape[1]
+    return [wav[:int(length * samples_per_frame)].numpy() for wav, length in zip(wavs, code_lengths.tolist())]
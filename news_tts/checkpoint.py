@@ -0,0 +1,45 @@
+import hashlib
+import os
+import numpy as np
+
+CHECKPOINT_DIR = "checkpoints"
+
+
+class ChunkCheckpoint:
+    """
+    Saves the audio of each finished chunk of a run so an interrupted run can
+    continue from where it stopped. Files are keyed by the chunk index and the
+    hash of its text, the speaker sample and the model version, so chunks of another
+    voice or model are never restored. They are written atomically, a chunk is either
+    complete or missing. on_put is called with each written file, e.g. to upload it.
+    """
+    def __init__(self, speaker_hash: str, model_version: str, checkpoint_dir: str = CHECKPOINT_DIR, on_put=None):
+        self._key_prefix = f"{speaker_hash}:{model_version}"
+        self._checkpoint_dir = checkpoint_dir
+        self._on_put = on_put
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.restored = 0
+
+    def _path(self, index: int, text: str) -> str:
+        chunk_hash = hashlib.sha256(f"{self._key_prefix}:{text}".encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self._checkpoint_dir, f"{index:05d}_{chunk_hash}.npz")
+
+    def get(self, index: int, text: str) -> np.ndarray | None:
+        """
+        Returns the saved audio of the chunk, None if it was not finished before
+        """
+        path = self._path(index, text)
+        if not os.path.exists(path):
+            return None
+
+        self.restored += 1
+        with np.load(path) as saved:
+            return saved["audio"]
+
+    def put(self, index: int, text: str, audio: np.ndarray):
+        path = self._path(index, text)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, audio=np.asarray(audio, dtype=np.float32), text=np.array(text))
+        os.replace(tmp_path, path)
+        if self._on_put is not None:
+            self._on_put(path)
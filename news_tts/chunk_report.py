@@ -0,0 +1,49 @@
+import argparse
+import json
+
+from preprocess import MAX_CHUNK_TOKENS
+from preprocess import TokenCounter
+from preprocess import chunk_text
+from preprocess import pack_text
+
+
+def count_inference_calls(sections: list[dict[str, str]], chunker) -> int:
+    """
+    Counts the TTS calls Generator.generate_audio makes for the sections with the given chunker
+    """
+    calls = 0
+    for section in sections:
+        calls += 1
+        for news in section['text']:
+            calls += len([chunk for chunk in chunker(news) if len(chunk) > 2])
+    return calls
+
+
+def main():
+    p = argparse.ArgumentParser(description="Reports the number of inference calls before and after token based packing.")
+    p.add_argument("json_files", nargs="+", help="Recorded parsed_news.json files.")
+    p.add_argument("--vocab-path", default="vocab.json", help="Path of the XTTS tokenizer file.")
+    p.add_argument("--max-tokens", type=int, default=MAX_CHUNK_TOKENS, help="Token budget of a single chunk.")
+    args = p.parse_args()
+
+    counter = TokenCounter(args.vocab_path)
+    total_before, total_after = 0, 0
+
+    print(f"{'file':<50} {'before':>8} {'after':>8}")
+    for json_file in args.json_files:
+        with open(json_file, "r", encoding="utf-8") as jf:
+            sections = json.load(jf)
+
+        before = count_inference_calls(sections, chunk_text)
+        after = count_inference_calls(sections, lambda text: pack_text(text, counter, args.max_tokens))
+        total_before += before
+        total_after += after
+        print(f"{json_file:<50} {before:>8} {after:>8}")
+
+    print(f"{'total':<50} {total_before:>8} {total_after:>8}")
+    if total_before:
+        print(f"Inference calls reduced by {100 * (1 - total_after / total_before):.1f}%")
+
+
+if __name__ == "__main__":
+    main()
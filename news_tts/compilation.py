@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import numpy as np
+import soundfile as sf
+
+from datetime import datetime
+from datetime import timedelta
+from scipy.signal import resample_poly
+
+from audio_writer import StreamingOggOpusWriter
+from audio_writer import StreamingWavWriter
+from downloader import S3Client
+
+# Daily outputs as they are stored in the bucket, the Ogg file is preferred when both exist
+DAILY_AUDIO_NAMES = ["news.ogg", "news.wav"]
+DAILY_METADATA_NAME = "output_metadata.json"
+DAILY_SECTIONS_NAME = "parsed_news.json"
+DAILY_PATH = "daily"
+COMPILATION_PATH = os.path.join("outputs", "compilation")
+# Pause between the compiled items so they do not run into each other
+ITEM_GAP_SECONDS = 0.6
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+def find_items(metadata: list[dict], sections: list[dict]) -> list[dict]:
+    """
+    Groups the metadata entries of a day into its section titles and news items.
+    Chunks do not record their news, a chunk belongs to the first news of its
+    section, from the current one on, whose text contains it.
+    """
+    items = []
+    section_index = -1
+    news_index = 0
+    for entry in metadata:
+        if section_index + 1 < len(sections) and entry["text"] == sections[section_index + 1]["section_title"]:
+            section_index += 1
+            news_index = 0
+            items.append({"section_title": entry["text"], "news_index": None, "text": entry["text"], "entries": [entry]})
+            continue
+        if section_index < 0:
+            continue
+
+        news = sections[section_index]["text"]
+        chunk = _normalize(entry["text"])
+        while news_index < len(news) and chunk not in _normalize(news[news_index]):
+            news_index += 1
+        if news_index == len(news):
+            # Text of the chunk was changed by preprocessing, it stays with the last news
+            news_index = len(news) - 1
+
+        last_item = items[-1]
+        if last_item["news_index"] == news_index and last_item["section_title"] == sections[section_index]["section_title"]:
+            last_item["entries"].append(entry)
+        else:
+            items.append({
+                "section_title": sections[section_index]["section_title"],
+                "news_index": news_index,
+                "text": news[news_index],
+                "entries": [entry]
+            })
+    return items
+
+
+def select_items(items: list[dict], section_titles: list[str] | None = None, keyword: str | None = None) -> list[dict]:
+    """
+    Returns the whole sections with the given titles, with their titles, and the news
+    items which contain the keyword. Both are case insensitive.
+    """
+    titles = {_normalize(title) for title in section_titles or []}
+    keyword = _normalize(keyword) if keyword else None
+
+    selected = []
+    for item in items:
+        in_section = _normalize(item["section_title"]) in titles
+        has_keyword = keyword is not None and item["news_index"] is not None and keyword in _normalize(item["text"])
+        if in_section or has_keyword:
+            selected.append(item)
+    return selected
+
+
+def load_day(day_dir: str) -> tuple[np.ndarray, int, list[dict]] | None:
+    """
+    Returns the audio, its sample rate and the items of a stored day, None if the day is missing
+    """
+    audio_names = [name for name in DAILY_AUDIO_NAMES if os.path.exists(os.path.join(day_dir, name))]
+    metadata_path = os.path.join(day_dir, DAILY_METADATA_NAME)
+    sections_path = os.path.join(day_dir, DAILY_SECTIONS_NAME)
+    if len(audio_names) == 0 or not os.path.exists(metadata_path) or not os.path.exists(sections_path):
+        return None
+
+    audio, sample_rate = sf.read(os.path.join(day_dir, audio_names[0]), dtype="float32")
+    with open(metadata_path, "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    with open(sections_path, "r", encoding="utf-8") as f:
+        sections = json.load(f)
+    for entry, next_entry in zip(metadata, metadata[1:] + [None]):
+        entry["next_start_ms"] = None if next_entry is None else next_entry["start_ms"]
+    return audio, sample_rate, find_items(metadata, sections)
+
+
+def _resample(samples: np.ndarray, sample_rate: int, target_rate: int) -> np.ndarray:
+    if sample_rate == target_rate:
+        return samples
+    gcd = np.gcd(sample_rate, target_rate)
+    return resample_poly(samples, target_rate // gcd, sample_rate // gcd).astype(np.float32)
+
+
+def compile_audio(day_dirs: list[str], writer, sample_rate: int, section_titles: list[str] | None = None, keyword: str | None = None) -> int:
+    """
+    Cuts the selected items out of the stored daily audio and appends them to the writer,
+    chunk by chunk with their metadata. Returns the number of compiled items.
+    """
+    num_samples = 0
+    num_items = 0
+    for day_dir in day_dirs:
+        day = load_day(day_dir)
+        if day is None:
+            print(f"Skipping {day_dir}, its audio or metadata is missing")
+            continue
+
+        audio, day_sample_rate, items = day
+        for item in select_items(items, section_titles, keyword):
+            for entry in item["entries"]:
+                # The pause after the speech is kept, it runs until the next chunk starts
+                start = int(entry["start_ms"] * day_sample_rate / 1000)
+                end = len(audio) if entry["next_start_ms"] is None else int(entry["next_start_ms"] * day_sample_rate / 1000)
+                samples = _resample(audio[start:end], day_sample_rate, sample_rate)
+                speech_ms = entry["end_ms"] - entry["start_ms"]
+
+                compiled_start_ms = int(num_samples / sample_rate * 1000)
+                compiled_entry = {
+                    "text": entry["text"],
+                    "start_ms": compiled_start_ms,
+                    "end_ms": compiled_start_ms + speech_ms,
+                    "day": os.path.basename(day_dir),
+                    "source_start_ms": entry["start_ms"]
+                }
+                num_samples += len(samples)
+                writer.write(samples.copy(), compiled_entry)
+
+            gap = np.zeros(int(ITEM_GAP_SECONDS * sample_rate), dtype=np.float32)
+            num_samples += len(gap)
+            writer.write_frames(gap)
+            num_items += 1
+    return num_items
+
+
+def main():
+    p = argparse.ArgumentParser(description="Compiles sections or news items of the stored daily bulletins into a new audio, without inference.")
+    p.add_argument("--end-date", default=datetime.today().strftime("%Y-%m-%d"), help="Last day of the compilation, YYYY-MM-DD.")
+    p.add_argument("--days", type=int, default=7, help="Number of days compiled, ending with the end date.")
+    p.add_argument("--section", action="append", help="Title of a section to compile, can be repeated.")
+    p.add_argument("--keyword", help="News items which contain the keyword are compiled.")
+    p.add_argument("--output-format", choices=["wav", "opus"], default="opus", help="Format of the compiled audio file.")
+    p.add_argument("--output-dir", default=COMPILATION_PATH)
+    p.add_argument("--daily-dir", default=DAILY_PATH, help="Local copies of the daily outputs, missing days are downloaded.")
+    p.add_argument("--no-download", action="store_true", help="Use only the daily outputs already in the daily directory.")
+    args = p.parse_args()
+
+    if not args.section and not args.keyword:
+        p.error("Either --section or --keyword is required")
+
+    end_date = datetime.strptime(args.end_date, "%Y-%m-%d")
+    days = [end_date - timedelta(days=offset) for offset in reversed(range(args.days))]
+    day_dirs = [os.path.join(args.daily_dir, day.strftime("%Y-%m-%d")) for day in days]
+
+    if not args.no_download:
+        s3_client = S3Client()
+        for day, day_dir in zip(days, day_dirs):
+            # Only one audio format is needed per day
+            available = s3_client.download_daily_outputs(day, day_dir, [DAILY_METADATA_NAME, DAILY_SECTIONS_NAME, DAILY_AUDIO_NAMES[0]])
+            if DAILY_AUDIO_NAMES[0] not in available:
+                s3_client.download_daily_outputs(day, day_dir, DAILY_AUDIO_NAMES[1:])
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    metadata_path = os.path.join(args.output_dir, "metadata.json")
+    # Daily bulletins are generated at this rate, Ogg inputs are resampled to it
+    sample_rate = 22050
+    if args.output_format == "opus":
+        audio_path = os.path.join(args.output_dir, "news.ogg")
+        writer = StreamingOggOpusWriter(audio_path, metadata_path, sample_rate)
+    else:
+        audio_path = os.path.join(args.output_dir, "news.wav")
+        writer = StreamingWavWriter(audio_path, metadata_path, sample_rate)
+
+    with writer:
+        num_items = compile_audio(day_dirs, writer, sample_rate, args.section, args.keyword)
+    print(f"Compiled {num_items} items into {audio_path}")
+
+
+if __name__ == "__main__":
+    main()
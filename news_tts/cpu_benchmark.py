@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import time
+
+from cpu_sharding import synthesize_sharded
+from preprocess import TokenCounter
+from preprocess import pack_text
+
+SAMPLE_RATE = 22050
+# Memory of a worker besides its weights, activations and the Python runtime
+WORKER_OVERHEAD_BYTES = 1024 * 1024 * 1024
+
+
+def load_text_chunks(json_file: str, vocab_path: str, limit: int) -> list[str]:
+    with open(json_file, "r", encoding="utf-8") as jf:
+        sections = json.load(jf)
+
+    counter = TokenCounter(vocab_path)
+    text_chunks = []
+    for section in sections:
+        for news in section['text']:
+            text_chunks.extend(chunk for chunk in pack_text(news, counter) if len(chunk) > 2)
+    return text_chunks[:limit]
+
+
+def _process_thread_splits(num_cores: int, max_processes: int) -> list[tuple[int, int]]:
+    """
+    Returns every (processes, threads) pair which uses all the cores with at most max_processes processes
+    """
+    return [(processes, num_cores // processes) for processes in range(1, min(num_cores, max_processes) + 1) if num_cores % processes == 0]
+
+
+def _max_processes_for_memory(model_path: str) -> int:
+    """
+    Number of workers whose models fit into the available memory, each loads the whole model
+    """
+    model_bytes = sum(os.path.getsize(os.path.join(model_path, file_name)) for file_name in os.listdir(model_path)
+                      if file_name.endswith((".pth", ".safetensors")))
+    available_bytes = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    return max(1, available_bytes // (model_bytes + WORKER_OVERHEAD_BYTES))
+
+
+def main():
+    p = argparse.ArgumentParser(description="Finds the best process x thread split for CPU inference.")
+    p.add_argument("--model-path", help="Path of the XTTS model.")
+    p.add_argument("--sample-wav", default="sample.wav", help="Reference speaker audio.")
+    p.add_argument("--json-file", default="input.json", help="Parsed news file to take the chunks from.")
+    p.add_argument("--num-chunks", type=int, default=16, help="Number of chunks synthesized for each split.")
+    p.add_argument("--cores", type=int, default=os.cpu_count(), help="Number of cores to divide.")
+    p.add_argument("--max-processes", type=int, help="Splits with more processes are skipped, derived from the available memory if not given.")
+    args = p.parse_args()
+
+    max_processes = args.max_processes or _max_processes_for_memory(args.model_path)
+    print(f"Trying splits with at most {max_processes} processes")
+
+    text_chunks = load_text_chunks(args.json_file, os.path.join(args.model_path, "vocab.json"), args.num_chunks)
+    results = []
+
+    print(f"{'processes':>10} {'threads':>8} {'seconds':>9} {'audio_s':>8} {'rtf':>6}")
+    for processes, threads in _process_thread_splits(args.cores, max_processes):
+        # Model load of the workers is measured too, it is paid on every real run
+        start_time = time.perf_counter()
+        audio_samples = sum(len(audio) for audio, _ in synthesize_sharded(args.model_path, args.sample_wav, text_chunks, processes, threads))
+        elapsed = time.perf_counter() - start_time
+
+        audio_seconds = audio_samples / SAMPLE_RATE
+        rtf = elapsed / audio_seconds if audio_seconds else float("inf")
+        results.append((rtf, processes, threads))
+        print(f"{processes:>10} {threads:>8} {elapsed:>9.1f} {audio_seconds:>8.1f} {rtf:>6.2f}")
+
+    best_rtf, best_processes, best_threads = min(results)
+    print(f"Best split: --cpu-workers {best_processes} --threads-per-worker {best_threads} (real-time factor {best_rtf:.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import multiprocessing
+import os
+import time
+import numpy as np
+import torch
+
+# Model of the worker process, loaded once by _init_worker
+_worker_generator = None
+
+
+def default_threads_per_worker(num_workers: int) -> int:
+    return max(1, (os.cpu_count() or 1) // max(1, num_workers))
+
+
+def _init_worker(tts_model_path: str, sample_path: str, num_threads: int, prepared_model_dir: str | None, backend: str):
+    global _worker_generator
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+
+    # Imported here since generator imports this module
+    from generator import Generator
+    _worker_generator = Generator(tts_model_path=tts_model_path, speaker_audio_sample_path=sample_path,
+                                  prepared_model_dir=prepared_model_dir, backend=backend)
+
+
+def _synthesize(text: str) -> tuple[np.ndarray, float]:
+    start_time = time.perf_counter()
+    audio = _worker_generator.synthesize(text)
+    return audio, time.perf_counter() - start_time
+
+
+def synthesize_sharded(tts_model_path: str, sample_path: str, text_chunks: list[str], num_workers: int, threads_per_worker: int,
+                       prepared_model_dir: str | None = None, backend: str = "torch"):
+    """
+    Shards the chunks across worker processes, each with its own model and a pinned
+    number of torch threads. Yields the audio of each chunk and its inference seconds in the original order.
+    """
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(num_workers, initializer=_init_worker, initargs=(tts_model_path, sample_path, threads_per_worker, prepared_model_dir, backend)) as pool:
+        for result in pool.imap(_synthesize, text_chunks):
+            yield result
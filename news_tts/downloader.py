@@ -1,16 +1,39 @@
 import os
+import json
+import time
 import boto3
 import requests
 
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-def get_date_str():
-    today = datetime.today()
+# Size of the pieces streamed between the network and the disk
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+# Objects larger than this are downloaded with parallel range requests
+PARALLEL_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+RANGE_PART_SIZE = 16 * 1024 * 1024
+MAX_RANGE_WORKERS = 8
+MAX_TRANSFER_RETRIES = 5
+# Files of a directory transferred at once through presigned links
+MAX_LINK_WORKERS = 8
+
+# ETag and size of the synced model files, kept next to them in the model directory
+MODEL_MANIFEST_NAME = ".manifest.json"
+MAX_MODEL_FILE_WORKERS = 4
+MODEL_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=64 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True,
+)
+
+def get_date_str(day: datetime | None = None):
+    today = day or datetime.today()
     return "{}/{}/{}".format(today.year, today.month, today.day)
 
 class S3Client:
     _BUCKET_NAME = "bekci-daily-news-synthesizer-bucket"
-    _date_str = get_date_str()
 
     def __init__(self):
         self.s3_client = boto3.client('s3')
@@ -19,35 +42,86 @@ class S3Client:
         """
         Downloads the JSON file from the specified S3 bucket to the local path.
         """
-        json_s3_prefix = f"outputs/{S3Client._date_str}/parsed_news.json"
+        json_s3_prefix = f"outputs/{get_date_str()}/parsed_news.json"
         print("Downloading JSON from S3:", json_s3_prefix)
         self.s3_client.download_file(S3Client._BUCKET_NAME, json_s3_prefix, local_path)
 
     def download_model_files(self, local_dir: str):
         """
-        Downloads the model file from the specified S3 bucket to the local path.
+        Syncs the model files from the S3 bucket to the local directory.
+        Files whose ETag and size match the local manifest are not downloaded again,
+        the rest are downloaded concurrently.
         """
         model_s3_prefix = "tts_model/latest/"
         print("Downloading model files..")
-        
+        start_time = time.perf_counter()
+
+        manifest_path = os.path.join(local_dir, MODEL_MANIFEST_NAME)
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+
+        remote_files = {}
         paginator = self.s3_client.get_paginator("list_objects_v2")
 
         for page in paginator.paginate(Bucket=S3Client._BUCKET_NAME, Prefix=model_s3_prefix):
             for obj in page.get("Contents", []):
                 key = obj["Key"]
-                rel_path = os.path.relpath(key, model_s3_prefix)
-                local_path = os.path.join(local_dir, rel_path)
 
                 # If the key ends with "/", it's a folder — skip it
                 if key.endswith("/"):
                     continue
 
-                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                remote_files[os.path.relpath(key, model_s3_prefix)] = {"key": key, "etag": obj["ETag"], "size": obj["Size"]}
+
+        to_download = [rel_path for rel_path, remote in remote_files.items() if not self._is_synced(local_dir, rel_path, remote, manifest)]
+        synced = {rel_path: manifest[rel_path] for rel_path in remote_files if rel_path not in to_download}
+
+        try:
+            with ThreadPoolExecutor(max_workers=MAX_MODEL_FILE_WORKERS) as executor:
+                futures = {rel_path: executor.submit(self._download_model_file, remote_files[rel_path]["key"], os.path.join(local_dir, rel_path))
+                           for rel_path in to_download}
+                for rel_path, future in futures.items():
+                    future.result()
+                    synced[rel_path] = {"etag": remote_files[rel_path]["etag"], "size": remote_files[rel_path]["size"]}
+        finally:
+            # Files finished before a failure are not downloaded again on the next start
+            os.makedirs(local_dir, exist_ok=True)
+            with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(synced, f, indent=2)
+            os.replace(manifest_path + ".tmp", manifest_path)
 
-                print(f"Downloading {key} → {local_path}")
-                self.s3_client.download_file(S3Client._BUCKET_NAME, key, local_path)
+        print(f"Model files synced in {time.perf_counter() - start_time:.1f} s: "
+              f"{len(to_download)} downloaded, {len(remote_files) - len(to_download)} unchanged")
 
-        self.s3_client.download_file(S3Client._BUCKET_NAME, model_s3_prefix, local_path)
+    def _is_synced(self, local_dir: str, rel_path: str, remote: dict, manifest: dict) -> bool:
+        local_path = os.path.join(local_dir, rel_path)
+        entry = manifest.get(rel_path)
+        return (entry is not None and entry["etag"] == remote["etag"] and entry["size"] == remote["size"]
+                and os.path.exists(local_path) and os.path.getsize(local_path) == remote["size"])
+
+    def _download_model_file(self, key: str, local_path: str):
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        print(f"Downloading {key} → {local_path}")
+        self.s3_client.download_file(S3Client._BUCKET_NAME, key, local_path, Config=MODEL_TRANSFER_CONFIG)
+
+    def download_daily_outputs(self, day: datetime, local_dir: str, file_names: list[str]) -> list[str]:
+        """
+        Downloads the outputs of the given day which exist in the bucket and not yet locally.
+        Returns the names of the files available in the local directory.
+        """
+        os.makedirs(local_dir, exist_ok=True)
+        available = []
+        for file_name in file_names:
+            local_path = os.path.join(local_dir, file_name)
+            if not os.path.exists(local_path):
+                try:
+                    self.s3_client.download_file(S3Client._BUCKET_NAME, f"outputs/{get_date_str(day)}/{file_name}", local_path)
+                except self.s3_client.exceptions.ClientError:
+                    continue
+            available.append(file_name)
+        return available
 
     def download_sample_wav(self, local_path: str):
         """
@@ -61,14 +135,14 @@ class S3Client:
         """
         Uploads the generated WAV file to the S3 bucket.
         """
-        s3_prefix = f"/generated/{S3Client._date_str}/news.wav"
+        s3_prefix = f"/generated/{get_date_str()}/news.wav"
         self.s3_client.upload_file(local_path, S3Client._BUCKET_NAME, s3_prefix)
 
     def upload_metadata_file(self, local_path: str):
         """
         Uploads the generated metadata json file to the S3 bucket.
         """
-        s3_prefix = f"/generated/{S3Client._date_str}/inference_info.json"
+        s3_prefix = f"/generated/{get_date_str()}/inference_info.json"
         self.s3_client.upload_file(local_path, S3Client._BUCKET_NAME, s3_prefix)
 
 
@@ -79,22 +153,182 @@ class S3APIClient:
     def download_file_with_link(self, url: str, local_path: str):
         """
         Downloads a file from a presigned URL to the local path.
+        The body is streamed to a .part file which is resumed if an earlier attempt
+        was interrupted, big objects are fetched with parallel range requests.
         """
         print("Downloading file from URL:", url)
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        with open(local_path, "wb") as f:
-            f.write(response.content)
+        start_time = time.perf_counter()
+        size, etag = self._with_retries(self._probe, url)
+
+        if size is not None and size >= PARALLEL_DOWNLOAD_THRESHOLD:
+            self._download_ranges(url, local_path, size, etag)
+        else:
+            part_path = local_path + ".part"
+            self._with_retries(self._download_range, url, part_path, 0, size, etag)
+            os.replace(part_path, local_path)
+            _remove_etag(part_path)
+
+        self._report("Downloaded", local_path, start_time)
 
-        print("Downloaded file to:", local_path)
-    
     def upload_file_with_link(self, local_path: str, url: str):
         """
         Uploads a file to a presigned URL.
+        The file is streamed from the disk and the upload is retried from the start on failure.
         """
         print("Uploading file to URL:", url)
-        
+        start_time = time.perf_counter()
+        self._with_retries(self._upload, local_path, url)
+        self._report("Uploaded", local_path, start_time)
+
+    def upload_file_with_post(self, local_path: str, post: dict):
+        """
+        Uploads a file with a presigned POST, which allows any file name under its key prefix.
+        Used for the audio segments whose number is not known when the links are created.
+        """
+        start_time = time.perf_counter()
+        self._with_retries(self._upload_post, local_path, post)
+        self._report("Uploaded", local_path, start_time)
+
+    def download_files_with_links(self, urls: dict[str, str], local_dir: str):
+        """
+        Downloads the files of a directory from their presigned URLs, keyed by file name.
+        Files already in the local directory are not downloaded again.
+        """
+        os.makedirs(local_dir, exist_ok=True)
+        missing = [name for name in urls if not os.path.exists(os.path.join(local_dir, name))]
+        with ThreadPoolExecutor(max_workers=MAX_LINK_WORKERS) as executor:
+            futures = [executor.submit(self.download_file_with_link, urls[name], os.path.join(local_dir, name)) for name in missing]
+            for future in futures:
+                future.result()
+
+    def upload_files_with_post(self, local_paths: list[str], post: dict):
+        """
+        Uploads the files concurrently with a presigned POST, each under its own file name
+        """
+        with ThreadPoolExecutor(max_workers=MAX_LINK_WORKERS) as executor:
+            futures = [executor.submit(self.upload_file_with_post, local_path, post) for local_path in local_paths]
+            for future in futures:
+                future.result()
+
+    def _probe(self, url: str) -> tuple[int | None, str | None]:
+        """
+        Returns the size and the ETag of the object, the size is None if the server does
+        not support range requests. A presigned GET URL cannot be used with HEAD.
+        """
+        with requests.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=30) as response:
+            # An empty object has no byte to satisfy the range
+            if response.status_code == 416:
+                return 0, response.headers.get("ETag")
+            response.raise_for_status()
+            etag = response.headers.get("ETag")
+            content_range = response.headers.get("Content-Range")
+            if response.status_code != 206 or content_range is None:
+                return None, etag
+            return int(content_range.rsplit("/", 1)[1]), etag
+
+    def _download_range(self, url: str, part_path: str, start: int, end: int | None, etag: str | None):
+        """
+        Streams the bytes [start, end) of the object to the part file, continuing after the
+        bytes that are already in it. The whole object is downloaded if end is None.
+        """
+        # A part is only continued with the ETag of the object it was started from
+        etag_path = part_path + ".etag"
+        if os.path.exists(part_path) and (not etag or _read_etag(etag_path) != etag):
+            os.remove(part_path)
+        done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if end is not None and start + done >= end:
+            # An empty object has no bytes to download, its part is still created
+            open(part_path, "ab").close()
+            return
+        if not done and etag:
+            with open(etag_path, "w", encoding="utf-8") as f:
+                f.write(etag)
+
+        headers = {}
+        if end is not None:
+            headers["Range"] = f"bytes={start + done}-{end - 1}"
+            # The server sends the whole object instead if it changed since the probe
+            if done and etag:
+                headers["If-Range"] = etag
+
+        with requests.get(url, headers=headers, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            if response.status_code == 200 and (start > 0 or done > 0):
+                if start > 0:
+                    raise RuntimeError(f"Object changed during the download of {part_path}")
+                done = 0
+
+            with open(part_path, "ab" if done else "wb") as f:
+                for chunk in response.iter_content(chunk_size=TRANSFER_CHUNK_SIZE):
+                    f.write(chunk)
+
+        if end is not None and os.path.getsize(part_path) != end - start:
+            raise requests.ConnectionError(f"Incomplete download of {part_path}")
+
+    def _download_ranges(self, url: str, local_path: str, size: int, etag: str | None):
+        """
+        Downloads the object in ranges on several threads, each range into its own
+        part file so an interrupted download continues where every range stopped
+        """
+        ranges = [(start, min(start + RANGE_PART_SIZE, size)) for start in range(0, size, RANGE_PART_SIZE)]
+        part_paths = [f"{local_path}.part{i}" for i in range(len(ranges))]
+
+        with ThreadPoolExecutor(max_workers=MAX_RANGE_WORKERS) as executor:
+            futures = [
+                executor.submit(self._with_retries, self._download_range, url, part_path, start, end, etag)
+                for part_path, (start, end) in zip(part_paths, ranges)
+            ]
+            for future in futures:
+                future.result()
+
+        tmp_path = local_path + ".part"
+        with open(tmp_path, "wb") as f:
+            for part_path in part_paths:
+                with open(part_path, "rb") as part:
+                    while chunk := part.read(TRANSFER_CHUNK_SIZE):
+                        f.write(chunk)
+        os.replace(tmp_path, local_path)
+        for part_path in part_paths:
+            os.remove(part_path)
+            _remove_etag(part_path)
+
+    def _upload(self, local_path: str, url: str):
         with open(local_path, "rb") as f:
-            response = requests.put(url, data=f)
-            response.raise_for_status()
\ No newline at end of file
+            response = requests.put(url, data=f, headers={"Content-Length": str(os.path.getsize(local_path))}, timeout=60)
+            response.raise_for_status()
+
+    def _upload_post(self, local_path: str, post: dict):
+        # The ${filename} in the key field is replaced by S3 with the name of the file
+        with open(local_path, "rb") as f:
+            response = requests.post(post["url"], data=post["fields"], files={"file": (os.path.basename(local_path), f)}, timeout=60)
+            response.raise_for_status()
+
+    def _with_retries(self, fn, *args):
+        for attempt in range(MAX_TRANSFER_RETRIES):
+            try:
+                return fn(*args)
+            # A connection dropped in the middle of the body raises ChunkedEncodingError
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError, requests.exceptions.ChunkedEncodingError) as e:
+                status = getattr(e.response, "status_code", None)
+                # Client errors such as an expired link do not get better with retrying
+                if status is not None and 400 <= status < 500 or attempt == MAX_TRANSFER_RETRIES - 1:
+                    raise
+                print(f"Transfer failed ({e}), retrying")
+                time.sleep(2 ** attempt)
+
+    def _report(self, action: str, local_path: str, start_time: float):
+        elapsed = time.perf_counter() - start_time
+        size_mb = os.path.getsize(local_path) / (1024 * 1024)
+        print(f"{action} {local_path}: {size_mb:.1f} MB in {elapsed:.1f} s ({size_mb / max(elapsed, 1e-6):.1f} MB/s)")
+
+
+def _read_etag(etag_path: str) -> str | None:
+    if not os.path.exists(etag_path):
+        return None
+    with open(etag_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _remove_etag(part_path: str):
+    if os.path.exists(part_path + ".etag"):
+        os.remove(part_path + ".etag")
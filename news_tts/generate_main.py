@@ -2,13 +2,31 @@ import argparse
 import os
 import json
 import logging
-import wave
+import shutil
+import time
 import scipy
 import numpy as np
 
+from contextlib import nullcontext
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from audio_writer import SegmentedOggOpusWriter
+from audio_writer import StreamingOggOpusWriter
+from audio_writer import StreamingWavWriter
+from backends import BACKENDS
 from downloader import S3APIClient
 from generator import Generator
-
+from prepared_model import PREPARED_MODEL_DIR
+from prepared_model import WEIGHTS_FILE
+from prepared_model import is_prepared
+from prepared_model import load_prepared_model
+from prepared_model import prepare_model
+from preprocess import TokenCounter
+from preprocess import get_text_chunks
+from profiling import profile_generation
+from timeline import Timeline
+
+logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -16,44 +34,69 @@ JSON_PATH = "input.json"
 SAMPLE_WAV_PATH = "sample.wav"
 OUTPUT_PATH = "outputs"
 OUTPUT_WAV_PATH = os.path.join(OUTPUT_PATH, "news.wav")
+OUTPUT_OGG_PATH = os.path.join(OUTPUT_PATH, "news.ogg")
 OUTPUT_METADATA_PATH = os.path.join(OUTPUT_PATH, "metadata.json")
+OUTPUT_SEGMENTS_PATH = os.path.join(OUTPUT_PATH, "segments")
+CHECKPOINT_PATH = "checkpoints"
+TIMELINE_PATH = os.path.join(OUTPUT_PATH, "timeline.json")
 
 
-def download_from_s3(s3_client: S3APIClient, url_config_json: str):
+def write_audio_files(gen: Generator, sections: list[dict[str, str]], output_format: str = "wav", output_path: str = OUTPUT_PATH,
+                      text_chunks: list[str] | None = None, segment_seconds: float | None = None, on_segment=None) -> str:
     """
-    Downloads necessary files from S3.
-    The files are input JSON containing the text input, TTS model, and sample WAV file for reference speaker.
+    Generates the audio of the sections with an already loaded generator into the output directory.
+    Returns the path of the audio file, or of the playlist for segments, the metadata is written next to it.
+    Segments are cut per section unless a segment duration is given, on_segment is called with
+    every finished segment and playlist file.
     """
-    with open(url_config_json, "r", encoding="utf-8") as jf:
-        config = json.load(jf)
-
-    s3_client.download_file_with_link(config["input_json_url"], JSON_PATH)
-    s3_client.download_file_with_link(config["sample_wav_url"], SAMPLE_WAV_PATH)
+    metadata_path = os.path.join(output_path, os.path.basename(OUTPUT_METADATA_PATH))
+
+    if output_format == "segments":
+        segments_path = os.path.join(output_path, os.path.basename(OUTPUT_SEGMENTS_PATH))
+        writer = SegmentedOggOpusWriter(segments_path, metadata_path, gen.get_sample_rate(),
+                                        [section["section_title"] for section in sections], segment_seconds, on_segment)
+        audio_path = writer.playlist_path
+    elif output_format == "opus":
+        audio_path = os.path.join(output_path, os.path.basename(OUTPUT_OGG_PATH))
+        writer = StreamingOggOpusWriter(audio_path, metadata_path, gen.get_sample_rate())
+    else:
+        audio_path = os.path.join(output_path, os.path.basename(OUTPUT_WAV_PATH))
+        writer = StreamingWavWriter(audio_path, metadata_path, gen.get_sample_rate())
+
+    with writer:
+        gen.generate_audio(sections, writer, text_chunks)
+    return audio_path
+
+
+def load_text_chunks(input_future: Future, vocab_path: str) -> tuple[list[dict[str, str]], list[str]]:
+    """
+    Waits for the input JSON and chunks its text, runs on a thread while the model loads
+    """
+    input_future.result()
+    with open(JSON_PATH, "r", encoding="utf-8") as jf:
+        content = json.load(jf)
+    return content, get_text_chunks(content, TokenCounter(vocab_path))
 
 
-def generate_audio_file_from_sections(model_path: str, sections: list[dict[str, str]]):
+def warm_model(model_path: str, prepared_model_dir: str):
     """
-    Given sections (list of dicts with 'section_title' and 'text'),
-    generates audio file and metadata using the TTS model.
+    Converts the model to the prepared format if it is not yet, then loads it once
+    so the weights are in the page cache before the first real run
     """
-    gen = Generator(tts_model_path=model_path, speaker_audio_sample_path=SAMPLE_WAV_PATH)
-    gen.generate_audio(sections)
-    
-    write_wav_int16(OUTPUT_WAV_PATH, gen.get_audio_data(), gen.get_sample_rate())
-    
-    with open(OUTPUT_METADATA_PATH, "w", encoding="utf-8") as mf:
-        json.dump(gen.get_metadata(), mf, ensure_ascii=False, indent=4)
-    
-
-def write_wav_int16(path: str, samples: np.ndarray, sample_rate: int):
-    # samples expected float32 in [-1, 1] or similar; convert to int16 PCM
-    clipped = np.clip(samples, -1.0, 1.0)
-    int16 = (clipped * 32767.0).astype(np.int16)
-    with wave.open(path, "wb") as wf:
-        wf.setnchannels(1)
-        wf.setsampwidth(2)  # bytes for int16
-        wf.setframerate(sample_rate)
-        wf.writeframes(int16.tobytes())
+    if not is_prepared(prepared_model_dir):
+        prepare_model(model_path, prepared_model_dir)
+
+    load_start = time.perf_counter()
+    try:
+        load_prepared_model(prepared_model_dir, "cpu")
+    except Exception as e:
+        # Directories prepared by an older version may not load, they are prepared again
+        logger.warning(f"Prepared model does not load ({e}), preparing it again")
+        os.remove(os.path.join(prepared_model_dir, WEIGHTS_FILE))
+        prepare_model(model_path, prepared_model_dir)
+        load_start = time.perf_counter()
+        load_prepared_model(prepared_model_dir, "cpu")
+    logger.info(f"Prepared model loads in {time.perf_counter() - load_start:.1f} s")
 
 
 def save_wav(path: str, samples: np.ndarray, sample_rate: int) -> None:
@@ -70,39 +113,132 @@ def save_wav(path: str, samples: np.ndarray, sample_rate: int) -> None:
     scipy.io.wavfile.write(path, sample_rate, wav_norm)
 
 
-def upload_results_to_s3(s3_client: S3APIClient, url_config_json: str):
-    """
-    Uploads the generated WAV file and metadata JSON to S3.
-    """
-    with open(url_config_json, "r", encoding="utf-8") as jf:
-        config = json.load(jf)
-    
-    s3_client.upload_file_with_link(OUTPUT_WAV_PATH, config["output_wav_url"])
-    s3_client.upload_file_with_link(OUTPUT_METADATA_PATH, config["output_metadata_url"])
-
-
 def main():
     p = argparse.ArgumentParser()
     p.add_argument("--model-path", help="Path of the XTTS model.")
     p.add_argument("--json-file", help="Path of the input config json file.")
+    p.add_argument("--batch-size", type=int, default=1, help="Number of chunks synthesized together, 1 disables batching.")
+    p.add_argument("--audio-cache-dir", help="Directory of the audio cache reused across days, disabled if not given.")
+    p.add_argument("--cpu-workers", type=int, default=0, help="Number of worker processes for CPU inference, 0 runs in a single process.")
+    p.add_argument("--threads-per-worker", type=int, help="Torch threads of each CPU worker, cores are divided evenly if not given.")
+    p.add_argument("--stream", action="store_true", help="Write audio frames to the output while each chunk is decoded.")
+    p.add_argument("--checkpoint-dir", default=CHECKPOINT_PATH, help="Directory of the finished chunks, a rerun continues from them.")
+    p.add_argument("--output-format", choices=["wav", "opus", "segments"], default="wav", help="Format of the generated audio, segments writes Ogg Opus segments with a playlist.")
+    p.add_argument("--segment-seconds", type=float, help="Duration of the segments, they are cut per section if not given.")
+    p.add_argument("--prepared-model-dir", default=PREPARED_MODEL_DIR, help="Directory of the safetensors model, used when it is prepared.")
+    p.add_argument("--warm", action="store_true", help="Prepare and load the model once, then exit. Meant to run when the container starts.")
+    p.add_argument("--backend", choices=BACKENDS, default="torch", help="Inference backend, int8 quantizes the linear layers for CPU.")
+    p.add_argument("--sync-audio-cache", action="store_true", help="Download the audio cache from S3 before the run and upload it after, through the links in the input config.")
+    p.add_argument("--sync-checkpoints", action="store_true", help="Upload each finished chunk to S3 and continue an interrupted run from them, through the links in the input config.")
+    p.add_argument("--profile", action="store_true", help="Run the PyTorch profiler and cProfile during generation, traces are written to the outputs.")
     args = p.parse_args()
 
+    if args.warm:
+        warm_model(args.model_path, args.prepared_model_dir)
+        return
+
     s3_client = S3APIClient()
-    
-    logger.info("Downloading necessary files from S3")
-    download_from_s3(s3_client, args.json_file)
+    with open(args.json_file, "r", encoding="utf-8") as jf:
+        config = json.load(jf)
+    # Segments are only published through the presigned POST, without it nothing would be uploaded
+    if args.output_format == "segments" and not config.get("output_segments_post"):
+        p.error("--output-format segments needs output_segments_post in the input config")
+    if args.sync_audio_cache and (not args.audio_cache_dir or "audio_cache_urls" not in config or not config.get("audio_cache_post")):
+        p.error("--sync-audio-cache needs --audio-cache-dir, and audio_cache_urls and audio_cache_post in the input config")
+    if args.sync_checkpoints and ("checkpoint_urls" not in config or not config.get("checkpoint_post")):
+        p.error("--sync-checkpoints needs checkpoint_urls and checkpoint_post in the input config")
     os.makedirs(OUTPUT_PATH, exist_ok=True)
 
-    # load json content (UTF-8)
-    with open(JSON_PATH, "r", encoding="utf-8") as jf:
-        content = json.load(jf)
-
-    logger.info("Generating audio...")
-    generate_audio_file_from_sections(args.model_path, content)
-
-    logger.info("Uploading results to S3")
-    upload_results_to_s3(s3_client, args.json_file)
-
+    # Finished chunks are uploaded in the background so another machine can continue the run
+    checkpoint_executor = ThreadPoolExecutor(max_workers=1)
+    checkpoint_futures = []
+    upload_checkpoint = None
+    if args.sync_checkpoints:
+        upload_checkpoint = lambda path: checkpoint_futures.append(checkpoint_executor.submit(s3_client.upload_file_with_post, path, config["checkpoint_post"]))
+
+    # Every stage is traced, the model loads while the inputs are downloaded and chunked
+    timeline = Timeline()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        logger.info("Downloading necessary files from S3 while the model loads")
+        input_future = executor.submit(timeline.run, "download_input", s3_client.download_file_with_link, config["input_json_url"], JSON_PATH)
+        sample_future = executor.submit(timeline.run, "download_sample", s3_client.download_file_with_link, config["sample_wav_url"], SAMPLE_WAV_PATH)
+        cache_future = None
+        if args.audio_cache_dir and args.sync_audio_cache:
+            cache_future = executor.submit(timeline.run, "download_audio_cache", s3_client.download_files_with_links, config["audio_cache_urls"], args.audio_cache_dir)
+        checkpoints_future = None
+        if args.sync_checkpoints:
+            checkpoints_future = executor.submit(timeline.run, "download_checkpoints", s3_client.download_files_with_links, config["checkpoint_urls"], args.checkpoint_dir)
+        chunks_future = executor.submit(timeline.run, "chunk_text", load_text_chunks, input_future, os.path.join(args.model_path, "vocab.json"))
+
+        gen = timeline.run(
+            "load_model",
+            Generator,
+            tts_model_path=args.model_path,
+            speaker_audio_sample_path=SAMPLE_WAV_PATH,
+            batch_size=args.batch_size,
+            audio_cache_dir=args.audio_cache_dir,
+            cpu_workers=args.cpu_workers,
+            threads_per_worker=args.threads_per_worker,
+            stream=args.stream,
+            checkpoint_dir=args.checkpoint_dir,
+            prepared_model_dir=args.prepared_model_dir,
+            backend=args.backend,
+            load_speaker=False,
+            on_checkpoint=upload_checkpoint
+        )
+
+        # Speaker latents and the audio cache need the sample, the cache needs its files too
+        sample_future.result()
+        if cache_future is not None:
+            cache_future.result()
+        timeline.run("load_speaker", gen.load_speaker)
+        content, text_chunks = chunks_future.result()
+        if checkpoints_future is not None:
+            checkpoints_future.result()
+
+        # Opus frames are encoded on a background thread while the next chunks are synthesized
+        # Segments are uploaded as soon as they are encoded, the other formats once finished
+        on_segment = None
+        if args.output_format == "segments":
+            on_segment = lambda path: s3_client.upload_file_with_post(path, config["output_segments_post"])
+
+        logger.info("Generating audio...")
+        with profile_generation(OUTPUT_PATH) if args.profile else nullcontext():
+            audio_path = timeline.run("synthesize", write_audio_files, gen, content, args.output_format,
+                                      text_chunks=text_chunks, segment_seconds=args.segment_seconds, on_segment=on_segment)
+
+        timings = gen.get_timings()
+        logger.info(f"Model load: {timings['model_load_seconds']} s, generation: {timings['generation_seconds']} s")
+        logger.info(f"Time to first audio: {gen.get_time_to_first_audio_ms()} ms")
+
+        logger.info("Uploading results to S3")
+        upload_futures = [
+            executor.submit(timeline.run, "upload_metadata", s3_client.upload_file_with_link, OUTPUT_METADATA_PATH, config["output_metadata_url"]),
+        ]
+        if args.output_format != "segments":
+            audio_url = config["output_ogg_url"] if args.output_format == "opus" else config["output_wav_url"]
+            upload_futures.append(executor.submit(timeline.run, "upload_audio", s3_client.upload_file_with_link, audio_path, audio_url))
+        if args.audio_cache_dir and args.sync_audio_cache:
+            # Cached audio files never change, only the new ones and the index are uploaded
+            cache_paths = [os.path.join(args.audio_cache_dir, name) for name in os.listdir(args.audio_cache_dir)
+                           if name not in config["audio_cache_urls"] or name == "index.json"]
+            upload_futures.append(executor.submit(timeline.run, "upload_audio_cache", s3_client.upload_files_with_post, cache_paths, config["audio_cache_post"]))
+        for future in upload_futures:
+            future.result()
+
+    checkpoint_executor.shutdown()
+    # Only the local copy is needed once the run is done, a failed upload is not fatal
+    for future in checkpoint_futures:
+        if future.exception() is not None:
+            logger.warning(f"Checkpoint upload failed: {future.exception()}")
+
+    timeline.write(TIMELINE_PATH)
+    for line in timeline.summary():
+        logger.info(line)
+
+    # The run is complete, the next one must not reuse these chunks. Uploaded ones are
+    # in the outputs of the day and are removed with them.
+    shutil.rmtree(args.checkpoint_dir, ignore_errors=True)
 
 if __name__ == "__main__":
     main()
@@ -1,76 +1,365 @@
 import os
+import time
 import torch
 import numpy as np
-from preprocess import chunk_text
+from audio_cache import AudioCache
+from backends import apply_backend
+from batch_inference import batched_inference
+from batch_inference import bucket_by_length
+from checkpoint import ChunkCheckpoint
+from cpu_sharding import default_threads_per_worker
+from cpu_sharding import synthesize_sharded
+from prepared_model import is_prepared
+from prepared_model import load_prepared_model
+from profiling import print_rtf_summary
+from preprocess import TokenCounter
+from preprocess import get_text_chunks
+from speaker_latents import get_model_version
+from speaker_latents import hash_file
+from speaker_latents import load_speaker_latents
 from tqdm import tqdm
 from TTS.api import TTS
 
+# Number of chunks bucketed together when batching, bounds how far the output lags behind
+BATCH_WINDOW_FACTOR = 8
+# Silence after each chunk, the pause Synthesizer.tts used to add after every sentence
+CHUNK_GAP_SAMPLES = 10000
+
 class Generator:
-    def __init__(self, tts_model_path:str, speaker_audio_sample_path: str):
+    def __init__(self, tts_model_path:str, speaker_audio_sample_path: str, batch_size: int = 1, audio_cache_dir: str | None = None,
+                 cpu_workers: int = 0, threads_per_worker: int | None = None, stream: bool = False,
+                 checkpoint_dir: str | None = None, prepared_model_dir: str | None = None, backend: str = "torch",
+                 load_speaker: bool = True, on_checkpoint=None):
         self._metadata = []
-        self._audio_data = []
+        # Audio is kept as float32 arrays per chunk, joined only once on get_audio_data
+        self._audio_chunks: list[np.ndarray] = []
+        self._num_samples = 0
+        self._audio_sink = None
+        self._generation_start = None
+        self._time_to_first_audio_ms = None
+        self._model_load_seconds = None
+        self._generation_seconds = None
         
+        self._tts_model_path = tts_model_path
         self._sample_path = speaker_audio_sample_path
+        self._prepared_model_dir = prepared_model_dir
+        self._backend = backend
+        self._batch_size = batch_size
+        self._stream = stream
+        self._cpu_workers = cpu_workers
+        self._threads_per_worker = threads_per_worker or default_threads_per_worker(cpu_workers)
         self._device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        
+        self._sample_rate = 22050
+        self._token_counter = TokenCounter(os.path.join(tts_model_path, "vocab.json"))
+        self._model_version = get_model_version(tts_model_path)
+        self._audio_cache_dir = audio_cache_dir
+        self._audio_cache = None
+
+        self._checkpoint_dir = checkpoint_dir
+        self._on_checkpoint = on_checkpoint
+        self._checkpoint = None
+
+        # Each worker process loads its own model in the sharded CPU mode
+        if cpu_workers > 0:
+            print(f"Using {cpu_workers} CPU worker processes with {self._threads_per_worker} threads each")
+        else:
+            self._load_model()
+
+        if load_speaker:
+            self.load_speaker()
+
+    def _load_model(self):
         if not torch.cuda.is_available():
             print("CUDA is not available. Using CPU for TTS inference, which will be really slow!!")
 
-        self._tts_model = TTS(model_path=tts_model_path, config_path=os.path.join(tts_model_path, "config.json") , progress_bar=False).to('cuda' if torch.cuda.is_available() else 'cpu')
-        self._sample_rate = 22050
+        load_start = time.perf_counter()
+        if self._prepared_model_dir is not None and is_prepared(self._prepared_model_dir):
+            self._xtts_model = load_prepared_model(self._prepared_model_dir, self._device)
+        else:
+            self._tts_model = TTS(model_path=self._tts_model_path, config_path=os.path.join(self._tts_model_path, "config.json") , progress_bar=False).to(self._device)
+            self._xtts_model = self._tts_model.synthesizer.tts_model
+        self._model_load_seconds = time.perf_counter() - load_start
+        print(f"Model loaded in {self._model_load_seconds:.1f} seconds")
+
+    def load_speaker(self):
+        """
+        Prepares everything that depends on the reference voice sample.
+        Called by the constructor unless the sample is still being downloaded.
+        """
+        speaker_hash = hash_file(self._sample_path)
+        if self._checkpoint_dir is not None:
+            self._checkpoint = ChunkCheckpoint(speaker_hash, self._model_version, self._checkpoint_dir, self._on_checkpoint)
+        if self._audio_cache_dir is not None:
+            self._audio_cache = AudioCache(speaker_hash, self._model_version, "tr", self._audio_cache_dir)
+
+        if self._cpu_workers > 0:
+            return
+
+        # Reference voice is conditioned once per run instead of once per chunk
+        self._gpt_cond_latent, self._speaker_embedding = load_speaker_latents(
+            self._xtts_model, self._sample_path, self._model_version
+        )
+        # Latents are computed with the full precision model, they are shared by all backends
+        self._xtts_model = apply_backend(self._xtts_model, self._backend, self._device)
 
     
-    def generate_audio(self, sections:list[dict[str,str]]):
+    def generate_audio(self, sections:list[dict[str,str]], audio_sink=None, text_chunks: list[str] | None = None):
         """
         Given a list of sections, feeds TTS model with each section (title and text)
         to generate an audio. 
         Stores metadata information that keeps the text provided the model and start and
-        stop miliseconds in the audio file
+        stop miliseconds in the audio file.
+        If an audio sink is given, each chunk is written to it instead of being kept in memory.
+        Every call starts a new audio, the model stays loaded between calls.
+        Text chunks of the sections can be given if they were prepared beforehand.
+        """
+        self._metadata = []
+        self._audio_chunks = []
+        self._num_samples = 0
+        self._audio_sink = audio_sink
+        self._generation_start = time.perf_counter()
+        self._time_to_first_audio_ms = None
+        if text_chunks is None:
+            text_chunks = get_text_chunks(sections, self._token_counter)
+
+        if self._cpu_workers > 0:
+            self._inference_sharded(text_chunks)
+        elif self._batch_size <= 1:
+            for index, text_chunk in enumerate(tqdm(text_chunks)):
+                stored_audio = self._get_stored_audio(index, text_chunk)
+                if stored_audio is not None:
+                    self._append_audio(text_chunk, stored_audio)
+                elif self._stream:
+                    self._inference_text_stream(index, text_chunk)
+                else:
+                    inference_start = time.perf_counter()
+                    stored_audio = self._infererence(text_chunk)
+                    inference_seconds = time.perf_counter() - inference_start
+                    self._store_audio(index, text_chunk, stored_audio)
+                    self._append_audio(text_chunk, stored_audio, inference_seconds)
+        else:
+            window_size = self._batch_size * BATCH_WINDOW_FACTOR
+            for window_start in tqdm(range(0, len(text_chunks), window_size)):
+                self._inference_window(text_chunks[window_start:window_start + window_size], window_start)
+
+        self._generation_seconds = time.perf_counter() - self._generation_start
+        self._print_cache_stats()
+        print_rtf_summary(self._metadata)
+
+    def _inference_sharded(self, text_chunks: list[str]):
+        """
+        Feeds the chunks missing from the cache to the CPU worker processes
+        and appends the results in the original order as they arrive
         """
-        for section in tqdm(sections):
-            self._inference_text(section['section_title'])
-            for news in section['text']:
-                detail_text_chunks = chunk_text(news)
-                for text_chunk in detail_text_chunks:
-                    if len(text_chunk) > 2:
-                        self._inference_text(text_chunk)
-                
+        stored_results = [self._get_stored_audio(index, text_chunk) for index, text_chunk in enumerate(text_chunks)]
+        missing_chunks = [text_chunk for text_chunk, result in zip(text_chunks, stored_results) if result is None]
+        sharded_results = synthesize_sharded(
+            self._tts_model_path, self._sample_path, missing_chunks, self._cpu_workers, self._threads_per_worker,
+            self._prepared_model_dir, self._backend
+        )
+
+        for index, (text_chunk, result) in enumerate(tqdm(zip(text_chunks, stored_results), total=len(text_chunks))):
+            inference_seconds = None
+            if result is None:
+                result, inference_seconds = next(sharded_results)
+                self._store_audio(index, text_chunk, result)
+            self._append_audio(text_chunk, result, inference_seconds)
 
-    def _inference_text(self, text: str):
+    def _inference_window(self, text_chunks: list[str], first_index: int):
         """
-        Given a text, feeds the TTS model, save results in metadata and the audio data
+        Feeds the chunks to the model in batches of similar token lengths,
+        then appends the results in the original order
         """
-        
-        result = self._infererence(text)
-        
-        start_index = len(self._audio_data)
-        self._audio_data.extend(float(n) for n in result)
-        end_index = len(self._audio_data)
-        
-        self._metadata.append({
+        results = [self._get_stored_audio(first_index + i, text_chunk) for i, text_chunk in enumerate(text_chunks)]
+        inference_seconds = [None] * len(text_chunks)
+        missing_indices = [i for i, result in enumerate(results) if result is None]
+        token_lengths = [self._token_counter.count(text_chunks[i]) for i in missing_indices]
+
+        for batch_positions in bucket_by_length(token_lengths, self._batch_size):
+            batch_indices = [missing_indices[position] for position in batch_positions]
+            batch_start = time.perf_counter()
+            batch_results = batched_inference(
+                self._xtts_model,
+                [text_chunks[i] for i in batch_indices],
+                "tr",
+                self._gpt_cond_latent,
+                self._speaker_embedding
+            )
+            # The batch time is shared by the chunks in proportion to their audio length
+            batch_seconds = time.perf_counter() - batch_start
+            batch_samples = max(1, sum(len(result) for result in batch_results))
+            for i, result in zip(batch_indices, batch_results):
+                results[i] = result
+                inference_seconds[i] = batch_seconds * len(result) / batch_samples
+                self._store_audio(first_index + i, text_chunks[i], result)
+
+        for text_chunk, result, seconds in zip(text_chunks, results, inference_seconds):
+            self._append_audio(text_chunk, result, seconds)
+
+    def _get_stored_audio(self, index: int, text: str) -> np.ndarray | None:
+        """
+        Returns the audio of the chunk from the checkpoint of an interrupted run
+        or from the audio cache, None if it must be synthesized
+        """
+        if self._checkpoint is not None:
+            audio = self._checkpoint.get(index, text)
+            if audio is not None:
+                return audio
+        if self._audio_cache is None:
+            return None
+        return self._audio_cache.get(text)
+
+    def _store_audio(self, index: int, text: str, audio):
+        audio = np.asarray(audio, dtype=np.float32)
+        if self._checkpoint is not None:
+            self._checkpoint.put(index, text, audio)
+        if self._audio_cache is not None:
+            self._audio_cache.put(text, audio)
+
+    def _print_cache_stats(self):
+        if self._checkpoint is not None:
+            print(f"Chunks restored from checkpoints: {self._checkpoint.restored}")
+        if self._audio_cache is not None:
+            print(f"Audio cache hits: {self._audio_cache.hits}, misses: {self._audio_cache.misses}")
+
+    def _append_audio(self, text: str, audio, inference_seconds: float | None = None):
+        """
+        Given a text and its generated audio, save results in metadata and the audio data.
+        Inference time is None for chunks restored from the checkpoint or the cache.
+        """
+        start_index = self._num_samples
+        self._append_frames(np.asarray(audio, dtype=np.float32))
+        self._append_gap(text, start_index, inference_seconds)
+
+    def _inference_text_stream(self, index: int, text: str):
+        """
+        Given a text, feeds the TTS model in streaming mode and appends
+        the audio frames as soon as they are decoded
+        """
+        start_index = self._num_samples
+        inference_start = time.perf_counter()
+        frames = []
+        for frame in self._infererence_stream(text):
+            frame = frame.cpu().numpy().astype(np.float32)
+            frames.append(frame.copy())
+            self._append_frames(frame)
+
+        inference_seconds = time.perf_counter() - inference_start
+        if len(frames) > 0:
+            self._store_audio(index, text, np.concatenate(frames))
+        self._append_gap(text, start_index, inference_seconds)
+
+    def _append_frames(self, frames: np.ndarray):
+        if self._time_to_first_audio_ms is None and len(frames) > 0:
+            self._time_to_first_audio_ms = int((time.perf_counter() - self._generation_start) * 1000)
+            print(f"Time to first audio: {self._time_to_first_audio_ms} ms")
+
+        self._num_samples += len(frames)
+        if self._audio_sink is not None:
+            self._audio_sink.write_frames(frames)
+        else:
+            self._audio_chunks.append(frames)
+
+    def _append_gap(self, text: str, start_index: int, inference_seconds: float | None = None):
+        """
+        Appends the pause after a chunk. The metadata entry ends with the speech, the
+        pause is written before it so segments are cut after the pause.
+        """
+        end_index = self._num_samples
+        self._append_frames(np.zeros(CHUNK_GAP_SAMPLES, dtype=np.float32))
+        self._append_metadata(text, start_index, end_index, inference_seconds)
+
+    def _append_metadata(self, text: str, start_index: int, end_index: int, inference_seconds: float | None = None):
+        audio_seconds = (end_index - start_index) / self._sample_rate
+        metadata_entry = {
             "text": text,
             "start_ms": int((start_index / self._sample_rate) * 1000),
-            "end_ms": int((end_index / self._sample_rate) * 1000)
-        })
+            "end_ms": int((end_index / self._sample_rate) * 1000),
+            "text_length": len(text),
+            "token_length": self._token_counter.count(text),
+            "audio_ms": int(audio_seconds * 1000),
+            "inference_ms": None if inference_seconds is None else int(inference_seconds * 1000),
+            "rtf": None if inference_seconds is None or audio_seconds == 0 else round(inference_seconds / audio_seconds, 3)
+        }
+        self._metadata.append(metadata_entry)
+
+        if self._audio_sink is not None:
+            self._audio_sink.write_metadata(metadata_entry)
 
     
     def _infererence(self, text: str):
         """
         Given a text, feeds the TTS model and returns the audio data
         """
-        result = self._tts_model.tts(
+        config = self._xtts_model.config
+        result = self._xtts_model.inference(
             text=text,
-            speaker_wav=self._sample_path,
-            language="tr"
+            language="tr",
+            gpt_cond_latent=self._gpt_cond_latent,
+            speaker_embedding=self._speaker_embedding,
+            temperature=config.temperature,
+            length_penalty=config.length_penalty,
+            repetition_penalty=config.repetition_penalty,
+            top_k=config.top_k,
+            top_p=config.top_p,
+            # Chunks are already packed by the token budget, do not split them again
+            enable_text_splitting=False
         )
-        return result
+        return result["wav"]
     
+    def _infererence_stream(self, text: str):
+        """
+        Given a text, feeds the TTS model and yields the audio frames while they are decoded
+        """
+        config = self._xtts_model.config
+        return self._xtts_model.inference_stream(
+            text=text,
+            language="tr",
+            gpt_cond_latent=self._gpt_cond_latent,
+            speaker_embedding=self._speaker_embedding,
+            temperature=config.temperature,
+            length_penalty=config.length_penalty,
+            repetition_penalty=config.repetition_penalty,
+            top_k=config.top_k,
+            top_p=config.top_p,
+            enable_text_splitting=False
+        )
+
+    def synthesize(self, text: str) -> np.ndarray:
+        """
+        Returns the audio of a single text without storing it
+        """
+        return np.asarray(self._infererence(text), dtype=np.float32)
+
     def get_audio_data(self) -> np.ndarray:
         """
         Returns the generated audio data as a numpy array
         """
-        return np.array(self._audio_data, dtype=np.float32)
+        if len(self._audio_chunks) == 0:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(self._audio_chunks)
     
+    def get_time_to_first_audio_ms(self) -> int | None:
+        """
+        Returns the time between the start of the generation and the first audio frame
+        """
+        return self._time_to_first_audio_ms
+
+    def get_xtts_model(self):
+        """
+        Returns the loaded XTTS model, None in the sharded CPU mode
+        """
+        return getattr(self, "_xtts_model", None)
+
+    def get_timings(self) -> dict[str, float | None]:
+        """
+        Returns the model load and generation durations in seconds
+        """
+        return {
+            "model_load_seconds": self._model_load_seconds,
+            "generation_seconds": self._generation_seconds
+        }
+
     def get_metadata(self) -> list[dict[str, str]]:
         """
         Returns the metadata information as a list of dictionaries
@@ -0,0 +1,66 @@
+import os
+import shutil
+import torch
+
+from safetensors.torch import load_model
+from safetensors.torch import save_model
+from TTS.tts.configs.xtts_config import XttsConfig
+from TTS.tts.layers.xtts.tokenizer import VoiceBpeTokenizer
+from TTS.tts.models.xtts import Xtts
+
+PREPARED_MODEL_DIR = "prepared_model"
+WEIGHTS_FILE = "model.safetensors"
+
+
+def is_prepared(prepared_dir: str) -> bool:
+    return all(os.path.exists(os.path.join(prepared_dir, file_name)) for file_name in [WEIGHTS_FILE, "config.json", "vocab.json"])
+
+
+def prepare_model(tts_model_path: str, prepared_dir: str = PREPARED_MODEL_DIR):
+    """
+    Converts the pickled XTTS checkpoint into safetensors once, next to a copy
+    of the config and the tokenizer file
+    """
+    print(f"Preparing the model from {tts_model_path} into {prepared_dir}")
+    config = XttsConfig()
+    config.load_json(os.path.join(tts_model_path, "config.json"))
+    model = Xtts.init_from_config(config)
+    model.load_checkpoint(config, checkpoint_dir=tts_model_path, eval=True)
+
+    os.makedirs(prepared_dir, exist_ok=True)
+    tmp_path = os.path.join(prepared_dir, WEIGHTS_FILE + ".tmp")
+    save_model(model, tmp_path)
+    shutil.copyfile(os.path.join(tts_model_path, "config.json"), os.path.join(prepared_dir, "config.json"))
+    shutil.copyfile(os.path.join(tts_model_path, "vocab.json"), os.path.join(prepared_dir, "vocab.json"))
+
+    # The saved weights must load back before the directory is taken as ready
+    try:
+        _load_model(prepared_dir, tmp_path, "cpu")
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    # Weights are moved last, a half prepared directory is never taken as ready
+    os.replace(tmp_path, os.path.join(prepared_dir, WEIGHTS_FILE))
+
+
+def load_prepared_model(prepared_dir: str, device: str) -> Xtts:
+    """
+    Builds XTTS from the prepared directory, the weights are memory mapped
+    instead of being unpickled
+    """
+    return _load_model(prepared_dir, os.path.join(prepared_dir, WEIGHTS_FILE), device)
+
+
+def _load_model(prepared_dir: str, weights_path: str, device: str) -> Xtts:
+    config = XttsConfig()
+    config.load_json(os.path.join(prepared_dir, "config.json"))
+    model = Xtts.init_from_config(config)
+    model.tokenizer = VoiceBpeTokenizer(vocab_file=os.path.join(prepared_dir, "vocab.json"))
+
+    # The weights are saved after load_checkpoint has shared the embeddings and the mel head
+    # with gpt_inference, the same aliases must exist for their names to match
+    model.gpt.init_gpt_for_inference(kv_cache=model.args.kv_cache, use_deepspeed=False)
+    load_model(model, weights_path, device=device)
+    model.hifigan_decoder.eval()
+    model.gpt.eval()
+    return model.to(torch.device(device))
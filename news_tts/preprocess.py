@@ -1,3 +1,15 @@
+import re
+
+from TTS.tts.layers.xtts.tokenizer import VoiceBpeTokenizer
+
+# Upper limit of the text tokens in a single chunk. A 225 characters long Turkish
+# chunk is around 125 tokens, staying close to it keeps the generated audio
+# well below the gpt_max_audio_tokens limit of the model. Chunks are also kept
+# within the character limit of the tokenizer for the language.
+MAX_CHUNK_TOKENS = 130
+LANGUAGE = "tr"
+
+
 def _chunk_by_word(sentence_to_chunk: str) -> list[str]:
     """
     Divides the sentence into without dividing any word
@@ -11,10 +23,13 @@ def _chunk_by_word(sentence_to_chunk: str) -> list[str]:
         if current_length + len(word) < 226:
             current_sentence += word + " "
             current_length += len(word) + 1
-        # Cannot add more word
+        # Cannot add more word, the word starts the next chunk
         else:
             result.append(current_sentence.strip())
-            current_length = 0
+            current_sentence = word + " "
+            current_length = len(word) + 1
+    if current_sentence.strip():
+        result.append(current_sentence.strip())
     return result
 
 def _chunk_sentence(sentence: str) -> list[str]:
@@ -69,4 +84,87 @@ def chunk_text(text: str) -> list[str]:
             result.append(sentence.strip())
         elif len(sentence) > 1:
             result.extend(_chunk_sentence(sentence))
-    return result
\ No newline at end of file
+    return result
+
+
+class TokenCounter:
+    """
+    Measures text length with the tokenizer of the XTTS model
+    """
+    def __init__(self, vocab_path: str, language: str = LANGUAGE):
+        self._tokenizer = VoiceBpeTokenizer(vocab_file=vocab_path)
+        self._language = language
+        # XTTS warns about truncated audio above this many characters
+        self.max_chars = self._tokenizer.char_limits[language]
+
+    def count(self, text: str) -> int:
+        return len(self._tokenizer.encode(text, self._language))
+
+    def fits(self, text: str, max_tokens: int) -> bool:
+        """
+        Returns whether the text is within both the character limit and the token budget,
+        the characters are checked first so longer texts are never encoded
+        """
+        return len(text) <= self.max_chars and self.count(text) <= max_tokens
+
+
+def _split_to_units(text: str, counter: TokenCounter, max_tokens: int) -> list[str]:
+    """
+    Divides the text into units which fit into the token budget and the character limit one by one.
+    Sentences are used when possible, then clauses and words at last.
+    """
+    units = []
+    for sentence in re.split(r'(?<=[.!?])\s+', text.strip()):
+        if counter.fits(sentence, max_tokens):
+            units.append(sentence)
+            continue
+
+        for clause in re.split(r'(?<=[,;:])\s+', sentence):
+            if counter.fits(clause, max_tokens):
+                units.append(clause)
+            else:
+                units.extend(_pack_units(clause.split(" "), counter, max_tokens))
+    return [unit.strip() for unit in units if unit.strip()]
+
+
+def _pack_units(units: list[str], counter: TokenCounter, max_tokens: int) -> list[str]:
+    """
+    Greedily joins the neighbouring units as long as the result fits into the token budget and the character limit
+    """
+    result = []
+    current_chunk = ""
+    for unit in units:
+        candidate = f"{current_chunk} {unit}".strip()
+        if current_chunk and not counter.fits(candidate, max_tokens):
+            result.append(current_chunk)
+            current_chunk = unit
+        else:
+            current_chunk = candidate
+    if current_chunk:
+        result.append(current_chunk)
+    return result
+
+
+def pack_text(text: str, counter: TokenCounter, max_tokens: int = MAX_CHUNK_TOKENS) -> list[str]:
+    """
+    Divides the text into chunks of at most max_tokens tokens of the XTTS tokenizer
+    and at most the character limit of the tokenizer.
+    Unlike chunk_text, short neighbouring sentences are packed into the same chunk
+    so the model is called as few times as possible.
+    """
+    return _pack_units(_split_to_units(text, counter, max_tokens), counter, max_tokens)
+
+
+def get_text_chunks(sections: list[dict[str, str]], counter: TokenCounter) -> list[str]:
+    """
+    Returns the texts to feed the model in the order they appear in the audio
+    """
+    text_chunks = []
+    for section in sections:
+        text_chunks.append(section['section_title'])
+        for news in section['text']:
+            detail_text_chunks = pack_text(news, counter)
+            for text_chunk in detail_text_chunks:
+                if len(text_chunk) > 2:
+                    text_chunks.append(text_chunk)
+    return text_chunks
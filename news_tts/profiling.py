@@ -0,0 +1,68 @@
+import cProfile
+import os
+import pstats
+import numpy as np
+import torch
+
+from contextlib import contextmanager
+
+# A chunk is reported as slow if its real-time factor is this many times the median
+SLOW_CHUNK_FACTOR = 2.0
+
+
+def find_slow_chunks(metadata: list[dict], factor: float = SLOW_CHUNK_FACTOR) -> list[dict]:
+    """
+    Returns the synthesized chunks whose real-time factor is well above the median, slowest first
+    """
+    synthesized = [entry for entry in metadata if entry.get("rtf") is not None]
+    if len(synthesized) == 0:
+        return []
+
+    median_rtf = float(np.median([entry["rtf"] for entry in synthesized]))
+    slow_chunks = [entry for entry in synthesized if entry["rtf"] > median_rtf * factor]
+    return sorted(slow_chunks, key=lambda entry: entry["rtf"], reverse=True)
+
+
+def print_rtf_summary(metadata: list[dict]):
+    synthesized = [entry for entry in metadata if entry.get("rtf") is not None]
+    if len(synthesized) == 0:
+        return
+
+    inference_ms = sum(entry["inference_ms"] for entry in synthesized)
+    audio_ms = sum(entry["audio_ms"] for entry in synthesized)
+    rtfs = [entry["rtf"] for entry in synthesized]
+    print(f"Synthesized {len(synthesized)} chunks, real-time factor: {inference_ms / max(1, audio_ms):.2f} "
+          f"(median {np.median(rtfs):.2f}, max {max(rtfs):.2f})")
+
+    for entry in find_slow_chunks(metadata):
+        print(f"Slow chunk: rtf {entry['rtf']:.2f}, {entry['token_length']} tokens, "
+              f"{entry['text_length']} chars, {entry['audio_ms']} ms audio: {entry['text'][:80]!r}")
+
+
+@contextmanager
+def profile_generation(output_dir: str):
+    """
+    Runs the PyTorch profiler and cProfile around the block. The Chrome trace of the
+    operators, the cProfile stats and a text report of both are written to the output directory.
+    """
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    python_profiler = cProfile.Profile()
+    with torch.profiler.profile(activities=activities, record_shapes=True) as torch_profiler:
+        python_profiler.enable()
+        try:
+            yield
+        finally:
+            python_profiler.disable()
+
+    torch_profiler.export_chrome_trace(os.path.join(output_dir, "torch_trace.json"))
+    python_profiler.dump_stats(os.path.join(output_dir, "generation.prof"))
+
+    sort_by = "cuda_time_total" if torch.cuda.is_available() else "cpu_time_total"
+    with open(os.path.join(output_dir, "profile.txt"), "w", encoding="utf-8") as f:
+        f.write(torch_profiler.key_averages(group_by_input_shape=True).table(sort_by=sort_by, row_limit=40))
+        f.write("\n\n")
+        pstats.Stats(python_profiler, stream=f).sort_stats("cumulative").print_stats(40)
+    print(f"Profiles written to {output_dir}")
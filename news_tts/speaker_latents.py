@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import numpy as np
+import torch
+
+LATENTS_CACHE_DIR = "speaker_latents"
+# Content hashes of the model checkpoints, kept in the model directory
+MODEL_HASHES_NAME = ".model_hashes.json"
+
+
+def hash_file(path: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_model_version(tts_model_path: str) -> str:
+    """
+    Identifies the model files by the content of the config and the checkpoints.
+    Hashes of the checkpoints are kept next to them by size and modification time,
+    so the files are only read again when they change.
+    """
+    hashes_path = os.path.join(tts_model_path, MODEL_HASHES_NAME)
+    hashes = {}
+    if os.path.exists(hashes_path):
+        with open(hashes_path, "r", encoding="utf-8") as f:
+            hashes = json.load(f)
+
+    model_hash = hashlib.sha256()
+    model_hash.update(hash_file(os.path.join(tts_model_path, "config.json")).encode())
+    updated = False
+    for file_name in sorted(os.listdir(tts_model_path)):
+        if file_name.endswith((".pth", ".safetensors")):
+            stat = os.stat(os.path.join(tts_model_path, file_name))
+            entry = hashes.get(file_name)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": hash_file(os.path.join(tts_model_path, file_name))}
+                hashes[file_name] = entry
+                updated = True
+            model_hash.update(f"{file_name}:{entry['sha256']}".encode())
+
+    if updated:
+        try:
+            with open(hashes_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(hashes, f, indent=2)
+            os.replace(hashes_path + ".tmp", hashes_path)
+        except OSError:
+            # A read-only model directory, e.g. a Kaggle input, is hashed on every run
+            pass
+    return model_hash.hexdigest()
+
+
+def load_speaker_latents(xtts_model, sample_path: str, model_version: str, cache_dir: str = LATENTS_CACHE_DIR):
+    """
+    Returns the GPT conditioning latent and the speaker embedding of the reference voice.
+    They are computed once for a sample file and model version, then loaded from the .npz cache.
+    """
+    cache_key = hashlib.sha256(f"{hash_file(sample_path)}:{model_version}".encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{cache_key[:32]}.npz")
+
+    if os.path.exists(cache_path):
+        print("Loading speaker latents from:", cache_path)
+        with np.load(cache_path) as cached:
+            gpt_cond_latent = torch.from_numpy(cached["gpt_cond_latent"])
+            speaker_embedding = torch.from_numpy(cached["speaker_embedding"])
+    else:
+        print("Computing speaker latents for:", sample_path)
+        gpt_cond_latent, speaker_embedding = xtts_model.get_conditioning_latents(
+            audio_path=[sample_path],
+            gpt_cond_len=xtts_model.config.gpt_cond_len,
+            gpt_cond_chunk_len=xtts_model.config.gpt_cond_chunk_len,
+            max_ref_length=xtts_model.config.max_ref_len,
+            sound_norm_refs=xtts_model.config.sound_norm_refs
+        )
+        os.makedirs(cache_dir, exist_ok=True)
+        # Sharded workers may compute the same latents at once, each writes its own file
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, gpt_cond_latent=gpt_cond_latent.cpu().numpy(), speaker_embedding=speaker_embedding.cpu().numpy())
+        os.replace(tmp_path, cache_path)
+
+    device = next(xtts_model.parameters()).device
+    return gpt_cond_latent.to(device), speaker_embedding.to(device)
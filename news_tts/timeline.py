@@ -0,0 +1,70 @@
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+class Timeline:
+    """
+    Records when each stage of a run starts and ends and on which thread.
+    Written in the Chrome trace format, it can be opened with chrome://tracing or Perfetto.
+    """
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._stages = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self._stages.append({
+                    "name": name,
+                    "thread": threading.current_thread().name,
+                    "start": start - self._start,
+                    "end": end - self._start,
+                })
+
+    def run(self, name: str, fn, *args, **kwargs):
+        with self.stage(name):
+            return fn(*args, **kwargs)
+
+    def summary(self) -> list[str]:
+        """
+        One line per stage, followed by the wall-clock time against the time
+        the stages would take one after another
+        """
+        with self._lock:
+            stages = sorted(self._stages, key=lambda s: s["start"])
+
+        lines = [f"{s['name']:<24} {s['start']:>8.2f} s -> {s['end']:>8.2f} s ({s['end'] - s['start']:.2f} s, {s['thread']})" for s in stages]
+        wall_seconds = max((s["end"] for s in stages), default=0.0)
+        sequential_seconds = sum(s["end"] - s["start"] for s in stages)
+        lines.append(f"Wall clock: {wall_seconds:.2f} s, sequential: {sequential_seconds:.2f} s")
+        return lines
+
+    def write(self, path: str):
+        with self._lock:
+            stages = list(self._stages)
+
+        thread_ids = {}
+        events = []
+        for s in stages:
+            events.append({
+                "name": s["name"],
+                "ph": "X",
+                "ts": int(s["start"] * 1e6),
+                "dur": int((s["end"] - s["start"]) * 1e6),
+                "pid": 0,
+                "tid": thread_ids.setdefault(s["thread"], len(thread_ids)),
+            })
+        for thread_name, tid in thread_ids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": tid, "args": {"name": thread_name}})
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events}, f)
@@ -0,0 +1,203 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+
+from backends import BACKENDS
+from downloader import S3APIClient
+from generate_main import SAMPLE_WAV_PATH
+from generate_main import write_audio_files
+from generator import Generator
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from prepared_model import PREPARED_MODEL_DIR
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOBS_OUTPUT_PATH = os.path.join("outputs", "jobs")
+# Finished jobs are forgotten, with their outputs, after the TTL or beyond the limit
+JOB_TTL_SECONDS = 60 * 60  # 1 hour
+MAX_FINISHED_JOBS = 1000
+# A job uploads a single audio file, segments are only published by generate_main
+JOB_OUTPUT_FORMATS = ["wav", "opus"]
+
+
+class JobWorker:
+    """
+    Keeps the model and the speaker latents loaded, and processes the
+    submitted jobs one after another on a background thread.
+    The state of the jobs and the metrics are only accessed under the lock.
+    """
+    def __init__(self, gen: Generator):
+        self._gen = gen
+        self._s3_client = S3APIClient()
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.metrics = {
+            "jobs_submitted": 0,
+            "jobs_succeeded": 0,
+            "jobs_failed": 0,
+            "model_load_seconds": gen.get_timings()["model_load_seconds"],
+            "last_generation_seconds": None,
+        }
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, job: dict) -> str:
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._jobs[job_id] = {"status": "queued", "submitted_at": int(time.time())}
+            self.metrics["jobs_submitted"] += 1
+        self._queue.put((job_id, job))
+        return job_id
+
+    def get_job(self, job_id: str) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return dict(self.metrics)
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def _set_job(self, job_id: str, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _finish_job(self, job_id: str, metric: str, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields, finished_at=int(time.time()))
+            self.metrics[metric] += 1
+            evicted = self._evict_jobs()
+        for evicted_id in evicted:
+            shutil.rmtree(os.path.join(JOBS_OUTPUT_PATH, evicted_id), ignore_errors=True)
+
+    def _evict_jobs(self) -> list[str]:
+        """
+        Drops the finished jobs older than the TTL, then the oldest ones beyond the limit.
+        Queued and running jobs are kept. Returns the dropped job IDs.
+        """
+        now = int(time.time())
+        finished = [job_id for job_id, job in self._jobs.items() if "finished_at" in job]
+        expired = {job_id for job_id in finished if now - self._jobs[job_id]["finished_at"] > JOB_TTL_SECONDS}
+        remaining = [job_id for job_id in finished if job_id not in expired]
+        evicted = [job_id for job_id in finished if job_id in expired] + remaining[:max(0, len(remaining) - MAX_FINISHED_JOBS)]
+        for job_id in evicted:
+            del self._jobs[job_id]
+        return evicted
+
+    def _run(self):
+        while True:
+            job_id, job = self._queue.get()
+            self._set_job(job_id, status="running")
+            try:
+                self._process(job_id, job)
+                self._finish_job(job_id, "jobs_succeeded", status="finished")
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}")
+                self._finish_job(job_id, "jobs_failed", status="failed", error=str(e))
+
+    def _process(self, job_id: str, job: dict):
+        output_path = os.path.join(JOBS_OUTPUT_PATH, job_id)
+        os.makedirs(output_path, exist_ok=True)
+
+        sections = job.get("sections")
+        if sections is None:
+            input_path = os.path.join(output_path, "input.json")
+            self._s3_client.download_file_with_link(job["input_json_url"], input_path)
+            with open(input_path, "r", encoding="utf-8") as jf:
+                sections = json.load(jf)
+
+        audio_path = write_audio_files(self._gen, sections, job.get("output_format", "wav"), output_path)
+        with self._lock:
+            self.metrics["last_generation_seconds"] = self._gen.get_timings()["generation_seconds"]
+        self._set_job(job_id, audio_path=audio_path)
+
+        if "output_audio_url" in job:
+            self._s3_client.upload_file_with_link(audio_path, job["output_audio_url"])
+        if "output_metadata_url" in job:
+            self._s3_client.upload_file_with_link(os.path.join(output_path, "metadata.json"), job["output_metadata_url"])
+
+
+def _create_handler(worker: JobWorker):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: dict):
+            content = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok"})
+            elif self.path == "/metrics":
+                self._send_json(200, {**worker.get_metrics(), "queue_size": worker.queue_size()})
+            elif self.path.startswith("/jobs/"):
+                job = worker.get_job(self.path[len("/jobs/"):])
+                if job is None:
+                    self._send_json(404, {"error": "Job not found"})
+                else:
+                    self._send_json(200, job)
+            else:
+                self._send_json(404, {"error": "Not found"})
+
+        def do_POST(self):
+            if self.path != "/jobs":
+                self._send_json(404, {"error": "Not found"})
+                return
+
+            try:
+                job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            except json.JSONDecodeError:
+                self._send_json(400, {"error": "Body must be JSON"})
+                return
+
+            if "sections" not in job and "input_json_url" not in job:
+                self._send_json(400, {"error": "Either sections or input_json_url is required"})
+                return
+
+            if job.get("output_format", "wav") not in JOB_OUTPUT_FORMATS:
+                self._send_json(400, {"error": f"output_format must be one of {JOB_OUTPUT_FORMATS}"})
+                return
+
+            self._send_json(202, {"job_id": worker.submit(job)})
+
+    return Handler
+
+
+def main():
+    p = argparse.ArgumentParser(description="Serves TTS jobs with a model that stays loaded.")
+    p.add_argument("--model-path", help="Path of the XTTS model.")
+    p.add_argument("--sample-wav", default=SAMPLE_WAV_PATH, help="Reference speaker audio.")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8082)
+    p.add_argument("--batch-size", type=int, default=1, help="Number of chunks synthesized together, 1 disables batching.")
+    p.add_argument("--prepared-model-dir", default=PREPARED_MODEL_DIR, help="Directory of the safetensors model, used when it is prepared.")
+    p.add_argument("--backend", choices=BACKENDS, default="torch", help="Inference backend, int8 quantizes the linear layers for CPU.")
+    args = p.parse_args()
+
+    gen = Generator(
+        tts_model_path=args.model_path,
+        speaker_audio_sample_path=args.sample_wav,
+        batch_size=args.batch_size,
+        prepared_model_dir=args.prepared_model_dir,
+        backend=args.backend
+    )
+    server = ThreadingHTTPServer((args.host, args.port), _create_handler(JobWorker(gen)))
+    logger.info(f"TTS server listening on {args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
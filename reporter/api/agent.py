@@ -1,17 +1,34 @@
 import os
+import time
 import logging
 
+from cache import AnswerCache
+from cache import CachedEmbeddings
+from cache import EMBEDDING_CACHE_SIZE
+from cache import EMBEDDING_CACHE_TTL_SECONDS
+from cache import LRUTTLCache
+from datetime import datetime
 from dotenv import load_dotenv
+from hashlib import sha1
 from langchain.agents import create_agent
 from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from langchain_core.messages import HumanMessage
 from langchain.agents.middleware import AgentMiddleware, AgentState
+from langchain.agents.middleware import SummarizationMiddleware
+from langchain.agents.middleware import hook_config
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_pinecone import PineconeVectorStore
-from langgraph.checkpoint.memory import InMemorySaver
+from memory import BoundedMemorySaver
 from pinecone import Pinecone
+from prompt import SUMMARY_PROMPT
 from prompt import SYSTEM_PROMPT
+from router import ROUTE_NONE
+from router import ROUTE_REUSE
+from router import route_query
 from typing import Any
+from typing import NotRequired
 from secret_manager import get_key_from_ssm
 
 load_dotenv()
@@ -21,14 +38,28 @@ os.environ["GOOGLE_API_KEY"] = get_key_from_ssm("google-api")
 INDEX_NAME = "daily-news"
 EMBED_MODEL_NAME = "gemini-embedding-001"
 CHAT_MODEL_NAME = "gemini-2.5-flash-lite"
+# Messages restored from the history table when a conversation is no longer in memory
+MAX_RESTORED_MESSAGES = 20
+# Recent messages are sent verbatim up to this many tokens, older ones are folded into a summary.
+# The summary is only refreshed once the history is over the budget by the refresh margin.
+HISTORY_TOKEN_BUDGET = 3000
+SUMMARY_REFRESH_TOKENS = 1500
+# How often the index is checked for new documents, which invalidate the cached answers
+INDEX_POLL_SECONDS = 5 * 60
 
 # Lazy initialization - will be set on first use
 _vector_store = None
 _embedding_model = None
+_index = None
+# Query embeddings, shared by the requests served by the same warm process
+_embedding_cache = LRUTTLCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS)
+_answer_cache = AnswerCache()
+_index_vector_count = None
+_index_polled_at = None
 
 def get_vector_store():
     """Lazily initialize vector store with retry logic."""
-    global _vector_store, _embedding_model
+    global _vector_store, _embedding_model, _index
     
     if _vector_store is not None:
         return _vector_store
@@ -36,67 +67,162 @@ def get_vector_store():
     logger.info("Initializing Pinecone vector store...")
     try:
         pc_store = Pinecone(api_key=get_key_from_ssm("pinecone-key"))
-        index = pc_store.Index(name=INDEX_NAME)
-        _embedding_model = GoogleGenerativeAIEmbeddings(model=EMBED_MODEL_NAME)
-        _vector_store = PineconeVectorStore(embedding=_embedding_model, index=index)
+        _index = pc_store.Index(name=INDEX_NAME)
+        _embedding_model = CachedEmbeddings(GoogleGenerativeAIEmbeddings(model=EMBED_MODEL_NAME), EMBED_MODEL_NAME, _embedding_cache)
+        _vector_store = PineconeVectorStore(embedding=_embedding_model, index=_index)
         logger.info("Pinecone vector store initialized successfully")
         return _vector_store
     except Exception as e:
         logger.error(f"Failed to initialize Pinecone: {e}")
         raise
 
+def get_cache_stats() -> dict[str, dict]:
+    """Returns the size and the hit rate of the caches."""
+    return {"query_embeddings": _embedding_cache.stats(), "answers": _answer_cache.stats()}
+
+def _refresh_answer_cache():
+    """
+    Drops the cached answers of today once the daily documents are indexed.
+    The index is asked for its size at most once per poll interval.
+    """
+    global _index_vector_count, _index_polled_at
+
+    if _index_polled_at is not None and time.monotonic() - _index_polled_at < INDEX_POLL_SECONDS:
+        return
+    _index_polled_at = time.monotonic()
+
+    vector_count = _index.describe_index_stats()["total_vector_count"]
+    if _index_vector_count is not None and vector_count != _index_vector_count:
+        # The daily job indexes the news with the date it runs on
+        logger.info("New documents are indexed, dropping the cached answers of today")
+        _answer_cache.invalidate_date(datetime.today().strftime("%Y-%m-%d"))
+    _index_vector_count = vector_count
+
+def _doc_ids(docs: list[Document]) -> list[str]:
+    return [doc.id or sha1(doc.page_content.encode("utf-8")).hexdigest() for doc in docs]
+
+def _is_first_question(messages: list) -> bool:
+    """Answers are only cached for the questions which do not depend on an earlier turn."""
+    return sum(isinstance(message, HumanMessage) for message in messages) == 1
+
 class State(AgentState):
     context: list[Document]
+    answer_cached: NotRequired[bool]
+    route: NotRequired[str]
 
 class RetrieveDocumentsMiddleware(AgentMiddleware[State]):
     state_schema = State
 
+    @hook_config(can_jump_to=["end"])
     def before_model(self, state: AgentState) -> dict[str| Any] | None:
  
         last_query = state["messages"][-1]
+        previous_docs = state.get("context") or []
+        route = route_query(last_query.content, len(previous_docs) > 0)
+
+        # Greetings and thanks need no documents, follow-ups are answered with the previous ones
+        if route == ROUTE_NONE:
+            return {"route": route, "answer_cached": False}
+        if route == ROUTE_REUSE:
+            return {"messages": [self._augment(last_query, previous_docs)], "route": route, "answer_cached": False}
+
         vector_store = get_vector_store()
-        retrieved_docs = vector_store.similarity_search(last_query.content, k=5)
-        
-        docs_content = "\n\n".join(doc.page_content for doc in retrieved_docs)
+        query_embedding = vector_store.embeddings.embed_query(last_query.content)
+        retrieved_docs = vector_store.similarity_search_by_vector(query_embedding, k=5)
+
+        update = {
+            "messages": [self._augment(last_query, retrieved_docs)],
+            "context": retrieved_docs,
+            "answer_cached": False,
+            "route": route
+        }
+
+        if _is_first_question(state["messages"]):
+            _refresh_answer_cache()
+            cached_answer = _answer_cache.get(query_embedding, _doc_ids(retrieved_docs))
+            if cached_answer is not None:
+                # The same question was answered with the same documents, the model is skipped
+                update["messages"].append(AIMessage(content=cached_answer))
+                update["answer_cached"] = True
+                update["jump_to"] = "end"
+        return update
+
+    def _augment(self, query, docs: list[Document]):
+        docs_content = "\n\n".join(doc.page_content for doc in docs)
 
         augmented_message_content = (
-            f"{last_query.content}\n\n"
+            f"{query.content}\n\n"
             f"Kullanıcının sorusunu cevaplamak için bu bilgileri kullan:\n\n"
             f"{docs_content}"
         )
-
-        return {
-            "messages": [last_query.model_copy(update={"content": augmented_message_content})],
-            "context": retrieved_docs
-        }
+        return query.model_copy(update={"content": augmented_message_content})
 
 
 class Ulak:
-    def __init__(self):
+    def __init__(self, history_loader=None):
+        """
+        history_loader returns the saved messages of a conversation, it is used to
+        continue the conversations which were evicted from memory
+        """
         logger.info("Initializing agent...")
         model = ChatGoogleGenerativeAI(model=CHAT_MODEL_NAME)
+        self.checkpointer = BoundedMemorySaver()
+        self.history_loader = history_loader
         self.agent = create_agent(
             model,
             system_prompt=SYSTEM_PROMPT,
             tools=[], 
-            middleware=[RetrieveDocumentsMiddleware()],
-            checkpointer=InMemorySaver()
+            middleware=[
+                SummarizationMiddleware(
+                    model,
+                    trigger=("tokens", HISTORY_TOKEN_BUDGET + SUMMARY_REFRESH_TOKENS),
+                    keep=("tokens", HISTORY_TOKEN_BUDGET),
+                    summary_prompt=SUMMARY_PROMPT
+                ),
+                RetrieveDocumentsMiddleware()
+            ],
+            checkpointer=self.checkpointer
             )
-        self.config = RunnableConfig = {"configurable": {"thread_id": "1"}}
 
-    def query(self, user_query: str) -> str:
+    def _restore_history(self, conversation_id: str, user_query: str) -> list[tuple[str, str]]:
+        items = self.history_loader(conversation_id)
+        # The current question is saved before it is answered
+        if len(items) > 0 and items[-1]["role"] == "user" and items[-1]["message"] == user_query:
+            items = items[:-1]
+        return [(item["role"], item["message"]) for item in items[-MAX_RESTORED_MESSAGES:]]
 
+    def query(self, user_query: str, conversation_id: str) -> str:
+        config = {"configurable": {"thread_id": conversation_id}}
+
+        messages = [("user", user_query)]
+        if self.history_loader is not None and self.checkpointer.get_tuple(config) is None:
+            messages = self._restore_history(conversation_id, user_query) + messages
+
+        start_time = time.perf_counter()
         res = self.agent.invoke(
-            {"messages": user_query},
-            self.config
+            {"messages": messages},
+            config
         )
+        logger.info(f"Turn answered in {(time.perf_counter() - start_time) * 1000:.0f} ms, route: {res.get('route')}, cached: {res.get('answer_cached', False)}")
 
         ai_response = res['messages'][-1].content
+        usage = getattr(res['messages'][-1], "usage_metadata", None)
+        if usage:
+            logger.info(f"Prompt tokens: {usage['input_tokens']}, history messages: {len(res['messages'])}")
         
-        if 'context' not in res:
+        if 'context' not in res or res.get('route') == ROUTE_NONE:
             return ai_response, None
         
         retrieved_docs = res['context']
         related_news = [doc.page_content for doc in retrieved_docs]
 
+        if _is_first_question(res['messages']) and not res.get('answer_cached') and isinstance(ai_response, str):
+            # The embedding of the question is in the embedding cache since the retrieval
+            _answer_cache.put(
+                get_vector_store().embeddings.embed_query(user_query),
+                _doc_ids(retrieved_docs),
+                {doc.metadata.get("date_str") for doc in retrieved_docs},
+                ai_response
+            )
+
         return ai_response, related_news
\ No newline at end of file
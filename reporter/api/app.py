@@ -7,6 +7,7 @@ import hmac
 import secrets
 
 from agent import Ulak
+from agent import get_cache_stats
 from datetime import datetime
 from dotenv import load_dotenv
 from fastapi import FastAPI
@@ -18,6 +19,8 @@ from secret_manager import get_key_from_ssm
 
 load_dotenv()
 DOWNLOAD_EXPIRES_IN = 60 * 3  # 3 minutes
+# Compressed audio is preferred, older days only have the WAV file
+AUDIO_FILE_NAMES = ["news.ogg", "news.wav"]
 TOKEN_INVALIDATION_TIME = 60 * 60 # 1 hour
 app = FastAPI()
 logging.basicConfig(level=logging.INFO)
@@ -31,7 +34,7 @@ def get_chat_agent():
     global _chat_agent
     if _chat_agent is None:
         logger.info("Initializing chat agent...")
-        _chat_agent = Ulak()
+        _chat_agent = Ulak(history_loader=db.get_messages_by_conversation)
         logger.info("Chat agent initialized!")
     return _chat_agent
 
@@ -171,7 +174,7 @@ def chat(request: ChatRequest):
     db.save_message(request.conversation_id, "user", request.message)
 
     agent = get_chat_agent()
-    response, documents = agent.query(request.message)
+    response, documents = agent.query(request.message, request.conversation_id)
 
     db.save_message(request.conversation_id, "assistant", response)
 
@@ -182,6 +185,14 @@ def chat(request: ChatRequest):
     )
 
 
+@app.get("/cache-stats")
+def cache_stats():
+    """
+    Returns the size and the hit rate of the caches of the warm process.
+    """
+    return get_cache_stats()
+
+
 @app.get("/download-options", response_model=list[str])
 def get_download_options():
     """
@@ -190,15 +201,14 @@ def get_download_options():
     logger.info("/download-options called!")
     date_today = datetime.today()
     conn = boto3.client('s3')
-    existing_file_keys = [key['Key'] for key in conn.list_objects(Bucket=os.environ["BUCKET_NAME"], Prefix=f'outputs/{date_today.year}/')['Contents'] if 'news.wav' in key['Key']]
-    existing_dates = []
+    existing_file_keys = [key['Key'] for key in conn.list_objects(Bucket=os.environ["BUCKET_NAME"], Prefix=f'outputs/{date_today.year}/')['Contents'] if key['Key'].split('/')[-1] in AUDIO_FILE_NAMES]
+    existing_dates = set()
     for file_key in existing_file_keys:
         parts = file_key.split('/')
         if len(parts) >= 5:
             year, month, day = parts[1], parts[2], parts[3]
-            existing_dates.append(f"{year}-{month.zfill(2)}-{day.zfill(2)}")
-    existing_dates.sort()
-    return existing_dates
+            existing_dates.add(f"{year}-{month.zfill(2)}-{day.zfill(2)}")
+    return sorted(existing_dates)
 
 
 @app.post("/download", response_model=DownloadLinkResponse)
@@ -214,20 +224,27 @@ def download_link(request: DownloadLinkRequest):
         date_requested = datetime.strptime(request.date_str, "%Y-%m-%d")
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
-    key_in_bucket = f"outputs/{date_requested.year}/{date_requested.month}/{date_requested.day}/news.wav"
+    key_prefix = f"outputs/{date_requested.year}/{date_requested.month}/{date_requested.day}/"
+    key_in_bucket = None
 
     # Checking if the file exists and can be accessed
-    try:
-        s3.head_object(Bucket=os.environ["BUCKET_NAME"], Key=key_in_bucket)
-    except ClientError as e:
-        error_code = e.response["Error"]["Code"]
-
-        if error_code == "404":
-            raise HTTPException(status_code=404, detail="File not found in S3")
-        elif error_code == "403":
-            raise HTTPException(status_code=403, detail="Access denied to S3 object")
-        else:
-            raise HTTPException(status_code=500, detail="Error checking file existence")
+    for file_name in AUDIO_FILE_NAMES:
+        try:
+            s3.head_object(Bucket=os.environ["BUCKET_NAME"], Key=key_prefix + file_name)
+            key_in_bucket = key_prefix + file_name
+            break
+        except ClientError as e:
+            error_code = e.response["Error"]["Code"]
+
+            if error_code == "404":
+                continue
+            elif error_code == "403":
+                raise HTTPException(status_code=403, detail="Access denied to S3 object")
+            else:
+                raise HTTPException(status_code=500, detail="Error checking file existence")
+
+    if key_in_bucket is None:
+        raise HTTPException(status_code=404, detail="File not found in S3")
 
     download_url = s3.generate_presigned_url(
         "get_object",
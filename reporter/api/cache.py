@@ -0,0 +1,158 @@
+import re
+import threading
+import time
+import numpy as np
+
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_SIZE = 1024
+EMBEDDING_CACHE_TTL_SECONDS = 6 * 60 * 60  # 6 hours
+ANSWER_CACHE_SIZE = 512
+ANSWER_CACHE_TTL_SECONDS = 12 * 60 * 60  # 12 hours
+# Cosine similarity of the query embeddings above which two questions get the same answer
+ANSWER_SIMILARITY_THRESHOLD = 0.95
+
+
+def normalize_query(query: str) -> str:
+    """
+    Folds the differences which do not change the meaning of a question,
+    case, repeated spaces and the punctuation at the ends
+    """
+    return re.sub(r"\s+", " ", query).strip().strip("?!.,").strip().casefold()
+
+
+class LRUTTLCache:
+    """
+    Thread safe cache which drops the least recently used entries above the size
+    limit and the entries older than the TTL. Counts its hits and misses.
+    """
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self._ttl_seconds:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeds the queries through the wrapped model only once per normalized query.
+    The cache is keyed by the model name, so a model change never returns old vectors.
+    Documents are embedded as they are, they are only embedded while indexing.
+    """
+    def __init__(self, embeddings: Embeddings, model_name: str, cache: LRUTTLCache):
+        self._embeddings = embeddings
+        self._model_name = model_name
+        self._cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        key = (self._model_name, normalize_query(text))
+        embedding = self._cache.get(key)
+        if embedding is None:
+            embedding = self._embeddings.embed_query(text)
+            self._cache.put(key, embedding)
+        return embedding
+
+
+class AnswerCache:
+    """
+    Answers keyed by the set of documents retrieved for the question. An answer is served
+    again for a question that retrieves the same documents and whose embedding is within
+    the similarity threshold. Entries are dropped when documents of one of their dates
+    are indexed again, when they are older than the TTL, or the least recently used ones
+    above the size limit.
+    """
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 threshold: float = ANSWER_SIMILARITY_THRESHOLD):
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._threshold = threshold
+        # Document IDs to the answers given with them
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query_embedding: list[float], doc_ids: list[str]) -> str | None:
+        key = frozenset(doc_ids)
+        query = _unit(query_embedding)
+        now = time.monotonic()
+        with self._lock:
+            for entry in self._entries.get(key, []):
+                if now - entry["created_at"] <= self._ttl_seconds and float(np.dot(entry["embedding"], query)) >= self._threshold:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    def put(self, query_embedding: list[float], doc_ids: list[str], dates: set[str], answer: str):
+        key = frozenset(doc_ids)
+        now = time.monotonic()
+        with self._lock:
+            entries = [entry for entry in self._entries.pop(key, []) if now - entry["created_at"] <= self._ttl_seconds]
+            entries.append({"embedding": _unit(query_embedding), "dates": dates, "answer": answer, "created_at": now})
+            self._entries[key] = entries
+            self._size = sum(len(entries) for entries in self._entries.values())
+            while self._size > self._max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def invalidate_date(self, date_str: str):
+        with self._lock:
+            for key in list(self._entries):
+                entries = [entry for entry in self._entries[key] if date_str not in entry["dates"]]
+                if len(entries) > 0:
+                    self._entries[key] = entries
+                else:
+                    del self._entries[key]
+            self._size = sum(len(entries) for entries in self._entries.values())
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+def _unit(embedding: list[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from langgraph.checkpoint.memory import InMemorySaver
+
+logger = logging.getLogger(__name__)
+
+MAX_THREADS = 200
+THREAD_TTL_SECONDS = 60 * 60  # 1 hour
+MAX_MEMORY_BYTES = 64 * 1024 * 1024
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    InMemorySaver which keeps only the latest checkpoint of each conversation and its parent.
+    Conversations idle longer than the TTL are dropped, then the least recently used ones
+    while there are too many of them or they take too much memory.
+    """
+    def __init__(self, max_threads: int = MAX_THREADS, ttl_seconds: float = THREAD_TTL_SECONDS, max_bytes: int = MAX_MEMORY_BYTES):
+        super().__init__()
+        self._max_threads = max_threads
+        self._ttl_seconds = ttl_seconds
+        self._max_bytes = max_bytes
+        # Thread ID to the last time it was used, least recently used first
+        self._last_used = OrderedDict()
+        self._sizes = {}
+        # Channel versions of the kept checkpoints, tells which blobs are still referenced
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            self._expire()
+            if thread_id not in self.storage:
+                return None
+            self._touch(thread_id)
+            return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            self._versions[(thread_id, checkpoint_ns, checkpoint["id"])] = dict(checkpoint["channel_versions"])
+            self._prune(thread_id, checkpoint_ns, {checkpoint["id"], config["configurable"].get("checkpoint_id")})
+            self._sizes[thread_id] = self._thread_size(thread_id)
+            self._touch(thread_id)
+            self._evict()
+            return next_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+            self._touch(config["configurable"]["thread_id"])
+
+    def delete_thread(self, thread_id: str):
+        with self._lock:
+            super().delete_thread(thread_id)
+            self._last_used.pop(thread_id, None)
+            self._sizes.pop(thread_id, None)
+            for key in [key for key in self._versions if key[0] == thread_id]:
+                del self._versions[key]
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"threads": len(self._last_used), "bytes": sum(self._sizes.values())}
+
+    def _touch(self, thread_id: str):
+        self._last_used[thread_id] = time.monotonic()
+        self._last_used.move_to_end(thread_id)
+
+    def _prune(self, thread_id: str, checkpoint_ns: str, keep: set[str]):
+        """
+        Drops the older checkpoints of the thread with their writes, and the blobs
+        no kept checkpoint refers to. Each blob of the messages channel holds the
+        whole conversation, so they would otherwise grow quadratically.
+        """
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for checkpoint_id in [checkpoint_id for checkpoint_id in checkpoints if checkpoint_id not in keep]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            self._versions.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        kept_versions = [self._versions.get((thread_id, checkpoint_ns, checkpoint_id)) for checkpoint_id in checkpoints]
+        if any(versions is None for versions in kept_versions):
+            return
+        referenced = {(channel, version) for versions in kept_versions for channel, version in versions.items()}
+        for key in [key for key in self.blobs if key[:2] == (thread_id, checkpoint_ns) and key[2:] not in referenced]:
+            del self.blobs[key]
+
+    def _thread_size(self, thread_id: str) -> int:
+        size = sum(len(blob[1]) for key, blob in self.blobs.items() if key[0] == thread_id)
+        for checkpoints in self.storage[thread_id].values():
+            size += sum(len(checkpoint[1]) + len(metadata[1]) for checkpoint, metadata, _ in checkpoints.values())
+        for key, writes in self.writes.items():
+            if key[0] == thread_id:
+                size += sum(len(value[1]) for _, _, value, _ in writes.values())
+        return size
+
+    def _expire(self):
+        now = time.monotonic()
+        while len(self._last_used) > 0:
+            thread_id, last_used = next(iter(self._last_used.items()))
+            if now - last_used < self._ttl_seconds:
+                break
+            self.delete_thread(thread_id)
+
+    def _evict(self):
+        self._expire()
+        # The most recent thread is kept even if it is over the memory limit alone
+        while len(self._last_used) > 1 and (len(self._last_used) > self._max_threads or sum(self._sizes.values()) > self._max_bytes):
+            thread_id = next(iter(self._last_used))
+            logger.info(f"Evicting the conversation {thread_id} from the agent memory")
+            self.delete_thread(thread_id)
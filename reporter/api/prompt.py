@@ -3,4 +3,14 @@ Kullanıcının sorunularını cevaplayan bir yapay zeka asistanısın. Cevaplar
 Cevaplarında kullanmak üzere sana bazı dökümanlar sağlanabilir. Cevaplarını bu dökümanlara dayanarak oluşturmalısın.
 Eğer dökümanlarda kullanıcının sorusunu cevaplayacak bilgi yoksa, "Bu konuda elimde yeterli bilgi yok." şeklinde cevap ver.
 Eğer kullanıcı sorusu gündem ile ilgili değilse, cevap ver ancak herhangi bir dökümana atıfta bulunma ve bunu belirt.
-"""
\ No newline at end of file
+"""
+SUMMARY_PROMPT = """
+Aşağıdaki konuşmanın daha eski kısmını özetle. Özet, konuşmaya devam ederken bu mesajların yerine kullanılacak.
+Kullanıcının sorduğu konuları, verilen cevaplardaki önemli bilgileri, tarihleri ve isimleri koru.
+Cevaplara eklenmiş dökümanları tekrar etme, sadece cevapta kullanılan bilgileri yaz. Özeti Türkçe yaz.
+Sadece özeti döndür.
+
+<messages>
+{messages}
+</messages>
+"""
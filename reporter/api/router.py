@@ -0,0 +1,81 @@
+import math
+
+from cache import normalize_query
+from collections import Counter
+
+ROUTE_RETRIEVE = "retrieve"
+ROUTE_REUSE = "reuse"
+ROUTE_NONE = "none"
+
+# Messages which need no documents at all
+CHIT_CHAT_PROTOTYPES = [
+    "merhaba", "selam", "selamlar", "günaydın", "iyi akşamlar", "iyi geceler", "iyi günler",
+    "teşekkürler", "teşekkür ederim", "çok teşekkürler", "sağ ol", "sağol", "sağ olun", "çok sağ ol", "eyvallah",
+    "tamam", "tamamdır", "anladım", "harika", "süper", "çok güzel", "görüşürüz", "hoşça kal",
+    "nasılsın", "sen kimsin", "kimsin", "ne yapabilirsin", "hello", "hi", "thanks", "thank you", "ok",
+]
+# Questions about the answer just given, the documents of the previous turn answer them
+FOLLOW_UP_PROTOTYPES = [
+    "neden", "niye", "nasıl yani", "peki neden", "bunun sebebi ne", "ne demek",
+    "biraz daha detay ver", "daha fazla bilgi ver", "detaylandırır mısın", "açıklar mısın", "bunu açıkla",
+    "kısaca özetle", "özetler misin", "daha kısa anlat", "devam et", "başka ne var",
+    "bununla ilgili başka ne var", "onun hakkında daha fazla anlat",
+]
+CHIT_CHAT_MAX_WORDS = 4
+FOLLOW_UP_MAX_WORDS = 8
+SIMILARITY_THRESHOLD = 0.6
+# A message this close to a prototype is routed even if it has words the prototype does not
+NEAR_EXACT_THRESHOLD = 0.85
+
+
+def _trigrams(text: str) -> Counter:
+    padded = f" {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    dot = sum(count * b[gram] for gram, count in a.items())
+    norm = math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values()))
+    return dot / norm if norm else 0.0
+
+
+def _prototypes(prototypes: list[str]) -> list[tuple[Counter, set[str]]]:
+    normalized = [normalize_query(prototype) for prototype in prototypes]
+    return [(_trigrams(prototype), set(prototype.split(" "))) for prototype in normalized]
+
+
+_CHIT_CHAT_PROTOTYPES = _prototypes(CHIT_CHAT_PROTOTYPES)
+_FOLLOW_UP_PROTOTYPES = _prototypes(FOLLOW_UP_PROTOTYPES)
+
+
+def _matches(normalized: str, prototypes: list[tuple[Counter, set[str]]]) -> bool:
+    """
+    A message matches a prototype if it is nearly the same text, or if it is similar
+    and has no words of its own, e.g. "açıklar mısın enflasyonu" asks about a new topic
+    """
+    trigrams = _trigrams(normalized)
+    words = set(normalized.split(" "))
+    for prototype_trigrams, prototype_words in prototypes:
+        similarity = _cosine(trigrams, prototype_trigrams)
+        if similarity >= NEAR_EXACT_THRESHOLD or (similarity >= SIMILARITY_THRESHOLD and words <= prototype_words):
+            return True
+    return False
+
+
+def route_query(query: str, has_context: bool) -> str:
+    """
+    Decides whether the documents are retrieved for the message, the documents of the
+    previous turn are reused, or no documents are needed. Short messages are compared
+    with the intent prototypes by their character trigrams, anything unclear is retrieved.
+    Follow-ups are checked first when there is a previous turn to refer to.
+    """
+    normalized = normalize_query(query)
+    if len(normalized) == 0:
+        return ROUTE_NONE
+
+    num_words = len(normalized.split(" "))
+    if has_context and num_words <= FOLLOW_UP_MAX_WORDS and _matches(normalized, _FOLLOW_UP_PROTOTYPES):
+        return ROUTE_REUSE
+    if num_words <= CHIT_CHAT_MAX_WORDS and _matches(normalized, _CHIT_CHAT_PROTOTYPES):
+        return ROUTE_NONE
+    return ROUTE_RETRIEVE
@@ -0,0 +1,82 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from langchain.agents import create_agent
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from memory import BoundedMemorySaver
+
+
+def _agent(saver: BoundedMemorySaver):
+    return create_agent(model=FakeListChatModel(responses=["tamam"]), tools=[], checkpointer=saver)
+
+
+def _ask(agent, thread_id: str, message: str) -> list:
+    config = {"configurable": {"thread_id": thread_id}}
+    return agent.invoke({"messages": [{"role": "user", "content": message}]}, config)["messages"]
+
+
+def _history(agent, thread_id: str) -> list:
+    return agent.get_state({"configurable": {"thread_id": thread_id}}).values.get("messages", [])
+
+
+def test_history_is_kept_across_turns_and_threads():
+    saver = BoundedMemorySaver()
+    agent = _agent(saver)
+    thread_ids = [f"conversation-{i}" for i in range(4)]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for turn in range(3):
+            list(executor.map(lambda thread_id: _ask(agent, thread_id, f"{thread_id} soru {turn}"), thread_ids))
+
+    for thread_id in thread_ids:
+        messages = _history(agent, thread_id)
+        assert [message.content for message in messages[::2]] == [f"{thread_id} soru {turn}" for turn in range(3)]
+    assert saver.stats()["threads"] == 4
+
+
+def test_old_checkpoints_and_blobs_are_pruned():
+    saver = BoundedMemorySaver()
+    agent = _agent(saver)
+    for turn in range(5):
+        _ask(agent, "a", f"soru {turn}")
+
+    for checkpoints in saver.storage["a"].values():
+        assert len(checkpoints) <= 2
+    message_blobs = [key for key in saver.blobs if key[0] == "a" and key[2] == "messages"]
+    assert 1 <= len(message_blobs) <= 2
+    assert len(_history(agent, "a")) == 10
+
+
+def test_least_recently_used_thread_is_evicted():
+    saver = BoundedMemorySaver(max_threads=2)
+    agent = _agent(saver)
+    _ask(agent, "a", "soru")
+    _ask(agent, "b", "soru")
+    _history(agent, "a")
+    _ask(agent, "c", "soru")
+
+    assert _history(agent, "b") == []
+    assert len(_history(agent, "a")) == 2
+    assert len(_history(agent, "c")) == 2
+
+
+def test_idle_thread_expires(monkeypatch):
+    saver = BoundedMemorySaver(ttl_seconds=60)
+    agent = _agent(saver)
+    _ask(agent, "a", "soru")
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert _history(agent, "a") == []
+    assert saver.stats()["threads"] == 0
+
+
+def test_memory_limit_keeps_only_the_latest_thread():
+    saver = BoundedMemorySaver(max_bytes=1)
+    agent = _agent(saver)
+    _ask(agent, "a", "soru")
+    _ask(agent, "b", "soru")
+
+    assert _history(agent, "a") == []
+    assert len(_history(agent, "b")) == 2
+    assert saver.stats()["threads"] == 1
@@ -0,0 +1,26 @@
+from router import ROUTE_NONE
+from router import ROUTE_RETRIEVE
+from router import ROUTE_REUSE
+from router import route_query
+
+
+def test_short_follow_up_reuses_context():
+    # "nasıl" is close to "nasılsın" but asks about the previous answer
+    assert route_query("nasıl", has_context=True) == ROUTE_REUSE
+
+
+def test_follow_up_with_new_topic_is_retrieved():
+    assert route_query("açıklar mısın enflasyonu", has_context=True) == ROUTE_RETRIEVE
+
+
+def test_follow_up_without_context_is_retrieved():
+    assert route_query("açıklar mısın", has_context=False) == ROUTE_RETRIEVE
+
+
+def test_chit_chat_needs_no_documents():
+    assert route_query("Merhaba!", has_context=False) == ROUTE_NONE
+    assert route_query("teşekkür ederim", has_context=True) == ROUTE_NONE
+
+
+def test_news_question_is_retrieved():
+    assert route_query("bugün dolar kuru ne oldu?", has_context=True) == ROUTE_RETRIEVE